@@ -37,17 +37,21 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'library',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'library.middleware.QueryBudgetMiddleware',
+    'library.middleware.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'library.middleware.LoanSelectionMiddleware',
 ]
 
 ROOT_URLCONF = 'biblioteca_publica.urls'
@@ -62,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'library.context_processors.navigation',
             ],
         },
     },
@@ -84,6 +89,140 @@ DATABASES = {
     }
 }
 
+# Réplica de lectura (library.routers.ReplicaRouter). En local apunta a la
+# misma base; en producción, a un servidor en replicación por streaming.
+# En las pruebas es un espejo de 'default'.
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['library.routers.ReplicaRouter']
+
+# Alias de las réplicas entre las que se reparten las lecturas de library
+LIBRARY_READ_REPLICAS = ['replica']
+
+# Una réplica con más retraso que este (o que no responde) se deja de usar;
+# el estado de cada réplica se vuelve a comprobar cada LIBRARY_REPLICA_CHECK_SECONDS
+LIBRARY_REPLICA_MAX_LAG_SECONDS = 10
+LIBRARY_REPLICA_CHECK_SECONDS = 5
+
+# Tras escribir, las lecturas de ese usuario van al primario durante este tiempo
+LIBRARY_PRIMARY_STICKY_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Debe ser compartida por todos los procesos: las entradas se invalidan
+# incrementando una versión, y cada worker tiene que ver el mismo valor.
+# En un despliegue con varios servidores conviene usar Redis o Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+    }
+}
+
+
+# Almacenamiento de la selección de préstamo (library.selection). La cookie
+# firmada no escribe nada en el servidor; CacheSelectionStore guarda la
+# selección en la caché y SessionSelectionStore en la sesión.
+
+LIBRARY_SELECTION_STORE = 'library.selection.SignedCookieSelectionStore'
+
+
+# Días de préstamo antes de que sweep_overdue_loans lo marque como vencido
+
+LIBRARY_LOAN_PERIOD_DAYS = 14
+
+
+# Días tras los que archive_loans traslada un préstamo devuelto a las tablas de archivo
+
+LIBRARY_ARCHIVE_AFTER_DAYS = 180
+
+# Préstamos antiguos que DeleteBookView archiva como mucho en cada petición
+
+LIBRARY_DELETE_BOOK_ARCHIVE_BATCH = 100
+
+
+# Libros de "otros lectores también se llevaron" en el detalle de un libro
+# (library.recommendations); la tabla guarda el triple por libro
+
+LIBRARY_RECOMMENDATIONS = 5
+
+
+# Cola de tareas en segundo plano (library.tasks, comando run_tasks). Una
+# tarea fallida se reintenta tras LIBRARY_TASK_RETRY_BACKOFF_SECONDS, el
+# doble cada vez hasta ..._MAX_SECONDS, y tras LIBRARY_TASK_MAX_ATTEMPTS
+# queda 'failed'. Si el worker no termina una tarea en
+# LIBRARY_TASK_TIMEOUT_SECONDS, otro la retoma. LIBRARY_TASK_CONCURRENCY
+# son los hilos de cada proceso run_tasks.
+
+LIBRARY_TASK_MAX_ATTEMPTS = 5
+LIBRARY_TASK_RETRY_BACKOFF_SECONDS = 30
+LIBRARY_TASK_RETRY_BACKOFF_MAX_SECONDS = 3600
+LIBRARY_TASK_TIMEOUT_SECONDS = 300
+LIBRARY_TASK_BATCH_SIZE = 20
+LIBRARY_TASK_CONCURRENCY = 2
+
+
+# Correos a los lectores (los envía run_tasks). En desarrollo se muestran en
+# la consola; en producción, django.core.mail.backends.smtp.EmailBackend.
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'Biblioteca Pública <biblioteca@ejemplo.com>'
+
+
+# Bajo ASGI (uvicorn) sirve el catálogo, el detalle y la selección con vistas async
+
+LIBRARY_ASYNC_VIEWS = False
+
+
+# Presupuesto de consultas SQL por vista (library.middleware.QueryBudgetMiddleware)
+# Se registra un aviso cuando una petición lo supera; library/tests.py
+# comprueba que cada ruta se mantiene dentro de él.
+
+LIBRARY_QUERY_BUDGET_DEFAULT = 10
+LIBRARY_QUERY_BUDGETS = {
+    'library:book_list': 3,
+    'library:book_list_by_genre': 3,
+    'library:book_search': 3,
+    'library:book_detail': 3,
+    'library:selection_detail': 3,
+    'library:add_to_selection': 3,
+    'library:remove_from_selection': 2,
+    'library:clear_selection': 2,
+    'library:api_selection': 3,
+    'library:api_selection_add': 3,
+    'library:api_selection_set': 3,
+    'library:api_selection_remove': 3,
+    'library:api_selection_clear': 2,
+    'library:api_genre_list': 1,
+    'library:api_book_list': 2,
+    'library:api_book_detail': 2,
+    'library:create_genre': 2,
+    'library:create_book': 3,
+    'library:create_loan': 16,
+    'library:loan_list': 4,
+    'library:loan_success': 4,
+    'library:return_loan': 11,
+    'library:delete_book': 19,
+    'library:export_csv': 2,
+    'library:stats': 7,
+    'library:login': 2,
+    'library:logout': 4,
+    'library:register': 2,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'library': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
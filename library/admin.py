@@ -1,5 +1,27 @@
 from django.contrib import admin
-from .models import Genre, Book, Reader, Loan, LoanItem
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Q
+from django.utils import timezone
+from .models import Genre, Book, Reader, Loan, LoanItem, ArchivedLoan, ArchivedLoanItem, Task
+from .pagination import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Listados pensados para tablas de millones de filas: el total se estima
+    con el planificador en lugar de un COUNT(*) y, al filtrar, no se cuenta
+    además la tabla completa.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+def reader_search(queryset, search_term, prefix=''):
+    """Lectores por prefijo del nombre o email exacto (índices UPPER(...))."""
+    return queryset.filter(
+        Q(**{f'{prefix}name__istartswith': search_term}) | Q(**{f'{prefix}email__iexact': search_term})
+    )
+
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
@@ -7,23 +29,116 @@ class GenreAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'genre', 'publication_year', 'available')
-    list_filter = ('genre', 'available', 'publication_year')
+class BookAdmin(LargeTableAdmin):
+    list_display = ('title', 'author', 'genre', 'publication_year', 'copies_total', 'copies_on_loan', 'available')
+    list_select_related = ('genre',)
+    # Cubiertos por el índice (genre, available, id). available es un
+    # GeneratedField: sin indicar el filtro, el admin listaría sus valores
+    # con un SELECT DISTINCT sobre toda la tabla, igual que con
+    # publication_year, que por eso no se ofrece como filtro.
+    list_filter = ('genre', ('available', admin.BooleanFieldListFilter))
+    # La búsqueda real usa search_vector (ver get_search_results)
     search_fields = ('title', 'author')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # Mismo índice GIN que BookSearchView, en lugar de ILIKE '%...%'
+        query = SearchQuery(search_term, search_type='websearch', config='spanish')
+        return queryset.filter(search_vector=query), False
+
 @admin.register(Reader)
-class ReaderAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email')
+class ReaderAdmin(LargeTableAdmin):
+    list_display = ('name', 'email', 'active_loans_count', 'last_loan_date')
     search_fields = ('name', 'email')
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return reader_search(queryset, search_term), False
+
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
-    list_display = ('reader', 'created_at', 'status')
+class LoanAdmin(LargeTableAdmin):
+    list_display = ('id', 'reader', 'created_at', 'status')
+    list_select_related = ('reader',)
     list_filter = ('status', 'created_at')
-    search_fields = ('reader__name',)
+    # Recorre los índices (created_at, id) y (status, created_at, id)
+    ordering = ('-created_at', '-id')
+    search_fields = ('reader__name', 'reader__email')
+    autocomplete_fields = ('reader',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return reader_search(queryset, search_term, prefix='reader__'), False
 
 @admin.register(LoanItem)
-class LoanItemAdmin(admin.ModelAdmin):
+class LoanItemAdmin(LargeTableAdmin):
     list_display = ('loan', 'book', 'quantity')
-    search_fields = ('book__title',)
+    list_select_related = ('loan__reader', 'book')
+    search_fields = ('loan__id', 'book__title')
+    raw_id_fields = ('loan',)
+    autocomplete_fields = ('book',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(loan_id=int(search_term)), False
+        query = SearchQuery(search_term, search_type='websearch', config='spanish')
+        return queryset.filter(book__search_vector=query), False
+
+class ArchivedLoanItemInline(admin.TabularInline):
+    model = ArchivedLoanItem
+    fields = ('book_id', 'book_title', 'quantity')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+@admin.register(ArchivedLoan)
+class ArchivedLoanAdmin(LargeTableAdmin):
+    """Historial de solo lectura: lo escribe archive_loans."""
+    list_display = ('id', 'reader', 'created_at', 'archived_at')
+    list_select_related = ('reader',)
+    ordering = ('-created_at', '-id')
+    search_fields = ('reader__name', 'reader__email')
+    inlines = [ArchivedLoanItemInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return reader_search(queryset, search_term, prefix='reader__'), False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('status',)
+    ordering = ('-id',)
+    readonly_fields = ('name', 'payload', 'status', 'attempts', 'run_after', 'created_at', 'last_error')
+    actions = ['retry_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Reintentar ahora')
+    def retry_now(self, request, queryset):
+        retried = queryset.exclude(status='running').update(status='pending', attempts=0, run_after=timezone.now())
+        self.message_user(request, f'{retried} tareas pendientes de nuevo')
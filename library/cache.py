@@ -0,0 +1,159 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .routers import primary_reads
+
+SYSTEM_NAME = "Biblioteca Pública"
+NAV_TIMEOUT = 60 * 60 * 24
+API_TIMEOUT = 60 * 60
+FRAGMENT_TIMEOUT = 60 * 60
+
+
+def _version_key(name):
+    return f"library:version:{name}"
+
+
+def _modified_key(name):
+    return f"library:modified:{name}"
+
+
+def get_version(name):
+    """
+    Versión actual de un grupo de entradas de caché.
+
+    Las claves que dependen del grupo incluyen la versión, de modo que al
+    incrementarla todas quedan invalidadas a la vez en todos los procesos.
+    Si la versión se pierde se reinicia con la hora actual para no volver
+    a coincidir con claves antiguas.
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    key = _version_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), timeout=None)
+    cache.set(_modified_key(name), time.time(), timeout=None)
+
+
+async def aget_version(name):
+    key = _version_key(name)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def get_last_modified(name):
+    """Momento (segundos epoch) del último ``bump_version`` del grupo."""
+    key = _modified_key(name)
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return modified
+
+
+def genre_scope(genre_id):
+    return f'catalogue:genre:{genre_id}'
+
+
+def book_scope(slug):
+    return f'catalogue:book:{slug}'
+
+
+def catalogue_changed(genre_ids=(), book_slugs=()):
+    """
+    Invalida lo cacheado del catálogo cuando la transacción en curso se
+    confirma: la versión ``catalogue`` (API y listado completo) y solo las
+    de los géneros y libros afectados.
+    """
+    names = ['catalogue']
+    names += [genre_scope(genre_id) for genre_id in set(genre_ids) if genre_id is not None]
+    names += [book_scope(slug) for slug in set(book_slugs) if slug]
+
+    def bump():
+        for name in names:
+            bump_version(name)
+
+    transaction.on_commit(bump)
+
+
+def books_changed(book_slugs):
+    """
+    Invalida solo el detalle de los libros ``book_slugs`` cuando la
+    transacción en curso se confirma: cambió algo que no sale en el
+    catálogo ni en la API (las recomendaciones).
+    """
+    names = [book_scope(slug) for slug in set(book_slugs) if slug]
+
+    def bump():
+        for name in names:
+            bump_version(name)
+
+    transaction.on_commit(bump)
+
+
+def fragment_key(name, *parts, versions=()):
+    """
+    Clave de un fragmento de plantilla renderizado.
+
+    Incluye las versiones de ``versions`` además de ``genres``, que cambia
+    con cualquier género (los nombres aparecen en todos los fragmentos) y
+    con las cargas masivas de ``seed_library``.
+    """
+    stamps = [get_version(version) for version in ('genres', *versions)]
+    return _fragment_key(name, parts, stamps)
+
+
+async def afragment_key(name, *parts, versions=()):
+    stamps = [await aget_version(version) for version in ('genres', *versions)]
+    return _fragment_key(name, parts, stamps)
+
+
+def _fragment_key(name, parts, stamps):
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    return f"library:fragment:{name}:{digest}:{'.'.join(map(str, stamps))}"
+
+
+def get_nav_genres():
+    from .models import Genre
+
+    key = f"library:nav_genres:{get_version('genres')}"
+    genres = cache.get(key)
+    if genres is None:
+        with primary_reads():
+            genres = list(Genre.objects.order_by('name'))
+        cache.set(key, genres, NAV_TIMEOUT)
+    return genres
+
+
+async def aget_nav_genres():
+    from .models import Genre
+
+    key = f"library:nav_genres:{await aget_version('genres')}"
+    genres = await cache.aget(key)
+    if genres is None:
+        with primary_reads():
+            genres = [genre async for genre in Genre.objects.order_by('name')]
+        await cache.aset(key, genres, NAV_TIMEOUT)
+    return genres
+
+
+def get_genre_id(slug):
+    """Id del género a partir del menú cacheado, sin consultar la base."""
+    for genre in get_nav_genres():
+        if genre.slug == slug:
+            return genre.id
+    return None
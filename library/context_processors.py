@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cache import SYSTEM_NAME, get_nav_genres
+
+
+def navigation(request):
+    """Datos de la barra de navegación compartidos por todas las páginas."""
+    return {
+        "system_name": SYSTEM_NAME,
+        # Perezoso: las vistas async pasan "genres" ya cargado y no se evalúa
+        "genres": SimpleLazyObject(get_nav_genres),
+    }
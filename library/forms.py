@@ -1,5 +1,5 @@
 from django import forms
-from .models import Genre, Book, Reader
+from .models import Genre, Book, Reader, Loan
 from datetime import datetime
 from django.utils.text import slugify
 from django.contrib.auth.forms import UserCreationForm
@@ -27,7 +27,7 @@ class GenreForm(forms.ModelForm):
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
-        fields = ['title', 'author', 'genre', 'publication_year', 'available']
+        fields = ['title', 'author', 'genre', 'publication_year', 'copies_total']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-input',
@@ -51,8 +51,10 @@ class BookForm(forms.ModelForm):
                 'max': '2100',
                 'value': datetime.now().year
             }),
-            'available': forms.CheckboxInput(attrs={
-                'class': 'form-checkbox',
+            'copies_total': forms.NumberInput(attrs={
+                'class': 'form-input',
+                'required': True,
+                'min': '1',
             }),
         }
     
@@ -67,6 +69,12 @@ class BookForm(forms.ModelForm):
             )
         return title
     
+    def clean_copies_total(self):
+        copies_total = self.cleaned_data.get('copies_total')
+        if copies_total is not None and copies_total < 1:
+            raise forms.ValidationError('El libro debe tener al menos un ejemplar.')
+        return copies_total
+
     def save(self, commit=True):
         instance = super().save(commit=False)
         if not instance.slug:
@@ -94,6 +102,34 @@ class ReaderForm(forms.ModelForm):
         }
 
 
+class LoanFilterForm(forms.Form):
+    status = forms.ChoiceField(
+        required=False,
+        choices=[('', 'Todos los estados')] + Loan.STATUS_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-input'}),
+    )
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={
+        'class': 'form-input',
+        'type': 'date',
+    }))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={
+        'class': 'form-input',
+        'type': 'date',
+    }))
+
+    def filter(self, queryset):
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data['status']:
+            queryset = queryset.filter(status=data['status'])
+        if data['date_from']:
+            queryset = queryset.filter(created_at__gte=data['date_from'])
+        if data['date_to']:
+            queryset = queryset.filter(created_at__lte=data['date_to'])
+        return queryset
+
+
 class CustomUserCreationForm(UserCreationForm):
     email = forms.EmailField(required=True, widget=forms.EmailInput(attrs={
         'class': 'form-input',
@@ -0,0 +1,250 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models.lookups import Exact, GreaterThan, GreaterThanOrEqual, In, LessThan, LessThanOrEqual
+from django.test import RequestFactory
+from django.utils import timezone
+
+from library.models import Book, Loan, LoanItem, Reader
+from library.pagination import KeysetPaginator
+from library.views import BookListView, BookSearchView, LoanListView
+
+EQUALITY = (Exact, In)
+RANGE = (GreaterThan, GreaterThanOrEqual, LessThan, LessThanOrEqual)
+
+
+def explain(qs, analyze=False):
+    """Plan de ejecución de ``qs`` como árbol JSON de PostgreSQL."""
+    sql, params = qs.query.sql_with_params()
+    options = 'ANALYZE, FORMAT JSON' if analyze else 'FORMAT JSON'
+    with connections[qs.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN ({options}) {sql}', params)
+        result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]['Plan']
+
+
+def table_rows(alias, relation):
+    """Filas estimadas de una tabla según las estadísticas de PostgreSQL."""
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [relation])
+        row = cursor.fetchone()
+    return max(int(row[0]), 0) if row else 0
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def where_columns(node, model, equality, ranges):
+    """Columnas de la tabla base usadas en igualdades y en rangos."""
+    for child in getattr(node, 'children', []):
+        if hasattr(child, 'children'):
+            # Las ramas OR (p. ej. el cursor keyset) no fijan columnas
+            if child.connector == 'AND' and not child.negated:
+                where_columns(child, model, equality, ranges)
+            continue
+        target = getattr(getattr(child, 'lhs', None), 'target', None)
+        if target is None or target.model is not model:
+            continue
+        if isinstance(child, EQUALITY) and target.column not in equality:
+            equality.append(target.column)
+        elif isinstance(child, RANGE) and target.column not in ranges:
+            ranges.append(target.column)
+
+
+def propose_index(qs):
+    """
+    Índice compuesto para una consulta: primero las columnas comparadas por
+    igualdad, luego las de rango y por último las del ORDER BY.
+    """
+    model = qs.model
+    equality, ranges = [], []
+    where_columns(qs.query.where, model, equality, ranges)
+    columns = list(equality)
+    for column in ranges:
+        if column not in columns:
+            columns.append(column)
+            break  # después de un rango las demás columnas no acotan
+    if len(columns) == len(equality):
+        for field_name in qs.query.order_by:
+            name = field_name.lstrip('-')
+            try:
+                field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                break  # anotaciones como el ranking de búsqueda
+            if getattr(field, 'model', None) is not model or not field.concrete:
+                break
+            if field.column not in columns:
+                columns.append(field.column)
+    return columns
+
+
+def existing_indexes(model):
+    meta = model._meta
+    indexes = [[meta.get_field(f.lstrip('-')).column for f in index.fields] for index in meta.indexes]
+    indexes += [[field.column] for field in meta.concrete_fields if field.db_index or field.unique]
+    for fields in meta.unique_together:
+        indexes.append([meta.get_field(f).column for f in fields])
+    return indexes
+
+
+def is_covered(columns, model):
+    return any(index[:len(columns)] == columns for index in existing_indexes(model))
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta EXPLAIN sobre las consultas que hacen las vistas de library y "
+        "los listados del admin, señala recorridos secuenciales y ordenaciones "
+        "sobre muchas filas y propone índices compuestos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help="Filas a partir de las cuales un Seq Scan o Sort se señala")
+        parser.add_argument('--analyze', action='store_true',
+                            help="Usa EXPLAIN ANALYZE (ejecuta las consultas) y filas reales")
+        parser.add_argument('--json', action='store_true', help="Salida en JSON")
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        self.user = User.objects.filter(is_superuser=True).first()
+        if self.user is None:
+            raise CommandError("Hace falta un superusuario para construir los listados del admin")
+
+        report = []
+        for name, qs in self.probes():
+            report.append(self.inspect(name, qs, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for entry in report:
+            if not entry['issues']:
+                continue
+            self.stdout.write(self.style.WARNING(entry['probe']))
+            for issue in entry['issues']:
+                self.stdout.write(f"  {issue['node']} en {issue['relation'] or '-'}: {issue['rows']} filas {issue['detail']}")
+            if entry['proposal']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"  índice propuesto: {entry['table']}({', '.join(entry['proposal'])})"
+                ))
+            elif entry['covered_by_existing_index']:
+                self.stdout.write("  ya existe un índice adecuado; el planificador prefirió otro plan")
+        flagged = sum(1 for entry in report if entry['issues'])
+        self.stdout.write(f"{len(report)} consultas analizadas, {flagged} con problemas")
+
+    def inspect(self, name, qs, options):
+        plan = explain(qs, options['analyze'])
+        issues = []
+        for node in plan_nodes(plan):
+            loops = node.get('Actual Loops', 1)
+            relation = node.get('Relation Name')
+            if node['Node Type'] == 'Seq Scan':
+                # Un Seq Scan lee la tabla entera, no solo las filas que devuelve
+                rows = table_rows(qs.db, relation) * loops
+                if rows >= options['rows']:
+                    issues.append({
+                        'node': 'Seq Scan', 'relation': relation, 'rows': rows,
+                        'detail': node.get('Filter', ''),
+                    })
+            elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                rows = node.get('Actual Rows' if options['analyze'] else 'Plan Rows', 0) * loops
+                if rows >= options['rows']:
+                    issues.append({
+                        'node': node['Node Type'], 'relation': None, 'rows': rows,
+                        'detail': ', '.join(node.get('Sort Key', [])),
+                    })
+            elif node.get('Rows Removed by Filter', 0) * loops >= options['rows']:
+                # Solo con --analyze: un índice que no acota y obliga a descartar filas
+                issues.append({
+                    'node': node['Node Type'], 'relation': relation,
+                    'rows': node['Rows Removed by Filter'] * loops,
+                    'detail': f"descartadas por {node.get('Filter', '')}",
+                })
+        proposal = propose_index(qs) if issues else []
+        covered = bool(proposal) and is_covered(proposal, qs.model)
+        return {
+            'probe': name,
+            'table': qs.model._meta.db_table,
+            'issues': issues,
+            'proposal': [] if covered else proposal,
+            'covered_by_existing_index': covered,
+        }
+
+    def request(self, path, query=None):
+        request = self.factory.get(path, query or {})
+        request.user = self.user
+        return request
+
+    def view_queryset(self, view_class, path, query=None, **kwargs):
+        view = view_class()
+        view.setup(self.request(path, query), **kwargs)
+        qs = view.get_queryset()
+        paginator = KeysetPaginator(qs, view.paginate_by, view.keyset_ordering)
+        return paginator.page_queryset()[0]
+
+    def changelist_queryset(self, model, query=None):
+        model_admin = admin.site._registry[model]
+        request = self.request(f'/admin/{model._meta.app_label}/{model._meta.model_name}/', query)
+        changelist = model_admin.get_changelist_instance(request)
+        return changelist.queryset[:changelist.list_per_page]
+
+    def probes(self):
+        book = Book.objects.select_related('genre').order_by('id').first()
+        reader = Reader.objects.order_by('id').first()
+        if not (book and reader):
+            raise CommandError("No hay datos: ejecuta primero seed_library")
+        genre = book.genre
+        today = timezone.localdate()
+        overdue = today - timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)
+
+        yield 'BookListView', self.view_queryset(BookListView, '/')
+        yield 'BookListView (género)', self.view_queryset(BookListView, '/', genre_slug=genre.slug)
+        yield 'BookSearchView', self.view_queryset(BookSearchView, '/search/', {'q': book.title.split()[0]})
+        yield 'LoanListView', self.view_queryset(LoanListView, '/loans/')
+        yield 'LoanListView (estado)', self.view_queryset(LoanListView, '/loans/', {'status': 'returned'})
+        yield 'LoanListView (fechas)', self.view_queryset(
+            LoanListView, '/loans/', {'date_from': (today - timedelta(days=30)).isoformat()}
+        )
+        yield 'CreateLoanView (lector por email)', Reader.objects.filter(email=reader.email)
+        # Las mismas que DeleteBookView: los préstamos que impiden el borrado,
+        # el lote de antiguos que archiva Loan.archive y los ítems que revisa
+        # el borrado (PROTECT)
+        archive_cutoff = today - timedelta(days=settings.LIBRARY_ARCHIVE_AFTER_DAYS)
+        book_loans = Loan.objects.filter(id__in=LoanItem.objects.filter(book=book).values('loan_id'))
+        yield 'DeleteBookView (préstamos recientes)', book_loans.exclude(
+            status='returned', created_at__lt=archive_cutoff
+        )[:1]
+        yield 'DeleteBookView (préstamos a archivar)', book_loans.filter(
+            status='returned'
+        ).order_by('created_at', 'id').values_list(
+            'id', 'reader_id', 'created_at'
+        )[:settings.LIBRARY_DELETE_BOOK_ARCHIVE_BATCH]
+        yield 'DeleteBookView (ítems del libro)', LoanItem.objects.filter(book=book)
+        loan_id = Loan.objects.order_by('id').values_list('id', flat=True).first()
+        if loan_id is not None:
+            yield 'ReturnLoanView (libros del préstamo)', LoanItem.objects.filter(loan=loan_id).values('book_id')
+        yield 'sweep_overdue_loans', Loan.objects.filter(
+            status='active', created_at__lt=overdue
+        ).order_by('created_at', 'id')[:1000]
+
+        for model in (Book, Reader, Loan, LoanItem):
+            yield f'admin {model.__name__}', self.changelist_queryset(model)
+        yield 'admin Book (género y disponibilidad)', self.changelist_queryset(
+            Book, {'genre__id__exact': genre.id, 'available__exact': '1'}
+        )
+        yield 'admin Loan (estado)', self.changelist_queryset(Loan, {'status__exact': 'active'})
+        yield 'admin Loan (fecha)', self.changelist_queryset(
+            Loan, {'created_at__gte': (today - timedelta(days=7)).isoformat()}
+        )
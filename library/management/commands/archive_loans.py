@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from library.models import Loan
+
+
+class Command(BaseCommand):
+    help = (
+        "Traslada a las tablas de archivo los préstamos devueltos hace más de "
+        "LIBRARY_ARCHIVE_AFTER_DAYS días, con sus ítems, en lotes. Cada lote "
+        "es una transacción corta; los préstamos archivados salen de la tabla "
+        "activa, así que una ejecución interrumpida continúa donde quedó."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Antigüedad mínima en días (por defecto LIBRARY_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Detenerse tras este número de lotes")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Segundos de pausa entre lotes")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = settings.LIBRARY_ARCHIVE_AFTER_DAYS
+        cutoff = timezone.localdate() - timedelta(days=days)
+        # Recorre el índice (status, created_at, id) desde los más antiguos
+        old = Loan.objects.filter(created_at__lt=cutoff)
+        total = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            archived = Loan.archive(old, limit=options['batch_size'])
+            if not archived:
+                break
+            total += archived
+            batches += 1
+            self.stdout.write(f"{total} préstamos archivados")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Listo: {total} préstamos archivados en {batches} lotes"))
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import statistics
+import time
+import types
+
+from django.contrib import admin
+from django.core.asgi import get_asgi_application
+from django.core.management.base import CommandError
+from django.test import Client, override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from library.management.commands.benchmark_library import Command as BenchmarkCommand, percentile
+from library.models import Book, Genre
+from library.urls import build_urlpatterns
+
+
+def build_urlconf(asynchronous):
+    """URLconf del proyecto con las vistas de library síncronas o async."""
+    urlconf = types.ModuleType(f"library_benchmark_urls_{'async' if asynchronous else 'sync'}")
+    urlconf.urlpatterns = [
+        path('admin/', admin.site.urls),
+        path('', include((build_urlpatterns(asynchronous), 'library'))),
+    ]
+    return urlconf
+
+
+async def asgi_get(application, url, headers):
+    """Hace un GET directamente a la aplicación ASGI; devuelve estado y cabeceras."""
+    path_info, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path_info,
+        'raw_path': path_info.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    body_sent = False
+    response = {}
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Nunca se desconecta: Django cancela esta espera al terminar
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.lower(): value for name, value in message['headers']}
+
+    await application(scope, receive, send)
+    return response
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Compara bajo ASGI, en proceso y con peticiones concurrentes, las "
+        "vistas síncronas y async del catálogo, el detalle de un libro y la "
+        "selección, y escribe el resultado como JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help="Peticiones medidas por ruta y modo")
+        parser.add_argument('--concurrency', type=int, default=20, help="Peticiones simultáneas")
+        parser.add_argument('--warmup', type=int, default=10, help="Peticiones previas no medidas")
+        parser.add_argument('--username', help="Superusuario con el que navegar (por defecto, el primero)")
+        parser.add_argument('--output', help="Archivo donde escribir el JSON (por defecto, stdout)")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        book = Book.objects.filter(available=True).order_by('id').first()
+        genre = Genre.objects.order_by('id').first()
+        if not (book and genre):
+            raise CommandError("No hay datos: ejecuta primero seed_library")
+
+        # Sesión iniciada y una selección con un libro, como un usuario real
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        client.post(reverse('library:add_to_selection', args=[book.slug]))
+        cookie = '; '.join(f'{name}={morsel.value}' for name, morsel in client.cookies.items())
+        headers = [(b'host', b'localhost'), (b'cookie', cookie.encode())]
+
+        routes = [
+            ('book_list', reverse('library:book_list')),
+            ('book_list_by_genre', reverse('library:book_list_by_genre', args=[genre.slug])),
+            ('book_detail', reverse('library:book_detail', args=[book.slug])),
+            ('selection_detail', reverse('library:selection_detail')),
+        ]
+
+        results = {}
+        for mode in ('sync', 'async'):
+            with override_settings(ROOT_URLCONF=build_urlconf(mode == 'async')):
+                application = get_asgi_application()
+                # django.setup() vuelve a aplicar LOGGING: silenciar después
+                logging.getLogger('library.queries').setLevel(logging.WARNING)
+                results[mode] = asyncio.run(self.measure_routes(application, routes, headers, options))
+            for name, result in results[mode].items():
+                self.stderr.write(f"{mode} {name}: {result['throughput_rps']} req/s, p95={result['p95_ms']} ms")
+
+        report = {
+            'timestamp': timezone.now().isoformat(),
+            'requests_per_route': options['requests'],
+            'concurrency': options['concurrency'],
+            'routes': {
+                name: {
+                    'sync': results['sync'][name],
+                    'async': results['async'][name],
+                    'speedup': round(
+                        results['async'][name]['throughput_rps'] / results['sync'][name]['throughput_rps'], 2
+                    ),
+                }
+                for name, _ in routes
+            },
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        else:
+            self.stdout.write(output)
+
+    async def measure_routes(self, application, routes, headers, options):
+        return {
+            name: await self.measure_route(application, url, headers, options)
+            for name, url in routes
+        }
+
+    async def measure_route(self, application, url, headers, options):
+        for _ in range(options['warmup']):
+            await asgi_get(application, url, headers)
+
+        timings, queries, statuses = [], [], set()
+        pending = iter(range(options['requests']))
+
+        async def worker():
+            for _ in pending:
+                t0 = time.perf_counter()
+                response = await asgi_get(application, url, headers)
+                timings.append((time.perf_counter() - t0) * 1000)
+                queries.append(int(response['headers'].get(b'x-db-query-count', 0)))
+                statuses.add(response['status'])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'url': url,
+            'status_codes': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'queries_mean': round(statistics.fmean(queries), 2),
+        }
@@ -0,0 +1,130 @@
+import json
+import logging
+import platform
+import statistics
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from library.models import Book, Genre, Loan, LoanItem, Reader
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide en proceso la latencia, el rendimiento y las consultas de cada URL "
+        "de library y escribe el resultado como JSON. Las rutas que modifican "
+        "préstamos o el catálogo (crear/devolver préstamos, crear/eliminar "
+        "libros) no se ejecutan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Peticiones medidas por ruta")
+        parser.add_argument('--warmup', type=int, default=10, help="Peticiones previas no medidas")
+        parser.add_argument('--username', help="Superusuario con el que navegar (por defecto, el primero)")
+        parser.add_argument('--only', nargs='*', help="Nombres de ruta a medir (p. ej. loan_list)")
+        parser.add_argument('--output', help="Archivo donde escribir el JSON (por defecto, stdout)")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        book = Book.objects.order_by('id').first()
+        genre = Genre.objects.order_by('id').first()
+        loan = Loan.objects.order_by('-id').first()
+        if not (book and genre and loan):
+            raise CommandError("No hay datos: ejecuta primero seed_library")
+
+        # El recuento de consultas llega en la cabecera de QueryBudgetMiddleware;
+        # su línea de registro por petición solo añadiría ruido aquí.
+        logging.getLogger('library.queries').setLevel(logging.WARNING)
+
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+
+        routes = [
+            ('book_list', 'get', reverse('library:book_list')),
+            ('book_list_by_genre', 'get', reverse('library:book_list_by_genre', args=[genre.slug])),
+            ('book_search', 'get', reverse('library:book_search') + '?q=' + book.title.split()[0]),
+            ('book_detail', 'get', reverse('library:book_detail', args=[book.slug])),
+            ('add_to_selection', 'post', reverse('library:add_to_selection', args=[book.slug])),
+            ('selection_detail', 'get', reverse('library:selection_detail')),
+            ('remove_from_selection', 'post', reverse('library:remove_from_selection', args=[book.id])),
+            ('clear_selection', 'post', reverse('library:clear_selection')),
+            ('create_loan', 'get', reverse('library:create_loan')),
+            ('loan_list', 'get', reverse('library:loan_list')),
+            ('loan_success', 'get', reverse('library:loan_success', args=[loan.id])),
+            ('create_genre', 'get', reverse('library:create_genre')),
+            ('create_book', 'get', reverse('library:create_book')),
+        ]
+        if options['only']:
+            routes = [route for route in routes if route[0] in options['only']]
+
+        results = {}
+        for name, method, url in routes:
+            results[name] = self.measure(client, method, url, options)
+            self.stderr.write(f"{name}: p50={results[name]['p50_ms']} ms, p95={results[name]['p95_ms']} ms")
+
+        report = {
+            'timestamp': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'requests_per_route': options['requests'],
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (Genre, Book, Reader, Loan, LoanItem)
+            },
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, username):
+        users = User.objects.filter(is_superuser=True)
+        if username:
+            users = users.filter(username=username)
+        user = users.order_by('id').first()
+        if user is None:
+            raise CommandError("Hace falta un superusuario (createsuperuser)")
+        return user
+
+    def measure(self, client, method, url, options):
+        send = getattr(client, method)
+        for _ in range(options['warmup']):
+            send(url)
+
+        timings, queries, statuses = [], [], set()
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+            t0 = time.perf_counter()
+            response = send(url)
+            timings.append((time.perf_counter() - t0) * 1000)
+            queries.append(int(response.get('X-DB-Query-Count', 0)))
+            statuses.add(response.status_code)
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'url': url,
+            'method': method.upper(),
+            'status_codes': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'queries_max': max(queries),
+        }
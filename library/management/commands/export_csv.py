@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from library.exports import CHUNK_SIZE, EXPORTS, stream_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta a CSV el historial de préstamos (una fila por libro "
+        "prestado), los lectores o el catálogo, en streaming."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--output', help="Archivo de salida (por defecto, stdout)")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Filas por lectura del cursor del servidor")
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as fh:
+                fh.writelines(stream_csv(options['dataset'], options['chunk_size']))
+        else:
+            for block in stream_csv(options['dataset'], options['chunk_size']):
+                self.stdout.write(block, ending='')
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from library.models import ArchivedLoan, Loan, Reader
+
+
+def recompute_reader_stats(readers):
+    """Recalcula los contadores de préstamos de ``readers`` con un solo UPDATE."""
+    loans = Loan.objects.filter(reader=OuterRef('pk')).values('reader')
+    outstanding = loans.annotate(
+        n=Count('id', filter=~Q(status='returned'))
+    ).values('n')
+    last = loans.annotate(last=Max('created_at')).values('last')
+    # Los préstamos archivados también cuentan para la fecha del último;
+    # GREATEST de PostgreSQL ignora el NULL de quien no tiene en una tabla
+    archived = ArchivedLoan.objects.filter(reader=OuterRef('pk')).values('reader')
+    last_archived = archived.annotate(last=Max('created_at')).values('last')
+    return readers.update(
+        active_loans_count=Coalesce(Subquery(outstanding), 0),
+        last_loan_date=Greatest(Subquery(last), Subquery(last_archived)),
+    )
+
+
+class Command(BaseCommand):
+    help = "Recalcula por lotes los contadores de préstamos de cada lector"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Reader.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += recompute_reader_stats(
+                Reader.objects.filter(id__gte=ids[0], id__lte=ids[-1])
+            )
+            last_id = ids[-1]
+            self.stdout.write(f"{total} lectores recalculados (hasta id {last_id})")
+        self.stdout.write(self.style.SUCCESS(f"Listo: {total} lectores recalculados"))
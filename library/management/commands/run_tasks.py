@@ -0,0 +1,80 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from library.tasks import claim, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta las tareas encoladas por los préstamos (estadísticas, "
+        "recomendaciones, correos). Cada hilo reserva lotes con SELECT ... "
+        "FOR UPDATE SKIP LOCKED, así que pueden correr varios procesos a la "
+        "vez sin repetir tareas. Termina el lote en curso al recibir SIGTERM "
+        "o Ctrl+C."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'LIBRARY_TASK_CONCURRENCY', 1),
+            help="Hilos que ejecutan tareas en este proceso",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'LIBRARY_TASK_BATCH_SIZE', 20),
+            help="Tareas que reserva cada hilo de una vez",
+        )
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Segundos de espera cuando la cola está vacía")
+        parser.add_argument('--once', action='store_true',
+                            help="Vaciar la cola y terminar en lugar de esperar tareas nuevas")
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.done = self.failed = 0
+        self.lock = threading.Lock()
+        previous = {
+            signum: signal.signal(signum, lambda *_: self.stopping.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            if options['concurrency'] <= 1:
+                self.work(options)
+            else:
+                threads = [
+                    threading.Thread(target=self.work_in_thread, args=(options,), name=f'run_tasks-{n}')
+                    for n in range(options['concurrency'])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {self.done} tareas completadas y {self.failed} con error"
+        ))
+
+    def work(self, options):
+        while not self.stopping.is_set():
+            tasks = claim(options['batch_size'])
+            if not tasks:
+                if options['once']:
+                    return
+                self.stopping.wait(options['poll'])
+                continue
+            for t in tasks:
+                ok = run(t)
+                with self.lock:
+                    self.done += ok
+                    self.failed += not ok
+
+    def work_in_thread(self, options):
+        try:
+            self.work(options)
+        finally:
+            # Cada hilo abre sus propias conexiones
+            connections.close_all()
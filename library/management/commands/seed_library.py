@@ -0,0 +1,156 @@
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from itertools import islice
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Greatest
+from django.utils.text import slugify
+
+from library.cache import bump_version
+from library.models import Book, Genre, Loan, LoanItem, Reader
+
+WORDS = (
+    'sombra viento mar noche ciudad jardín río memoria fuego silencio '
+    'camino tiempo luna casa invierno verano piedra cielo espejo sueño'
+).split()
+NAMES = 'Ana Luis Carmen Jorge Lucía Pedro Sofía Diego Elena Mateo'.split()
+SURNAMES = 'García Rodríguez López Martínez Pérez Gómez Díaz Torres Ruiz Vargas'.split()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_created_at():
+    """Permite fijar Loan.created_at en bulk_create en lugar de usar hoy."""
+    field = Loan._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Genera datos sintéticos de géneros, libros, lectores y préstamos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--readers', type=int, default=5000)
+        parser.add_argument('--loans', type=int, default=20000)
+        parser.add_argument('--max-items', type=int, default=3, help="Libros máximos por préstamo")
+        parser.add_argument('--max-copies', type=int, default=3, help="Ejemplares máximos por libro")
+        parser.add_argument('--days', type=int, default=365, help="Días de historial de préstamos")
+        parser.add_argument('--active-ratio', type=float, default=0.05,
+                            help="Fracción de préstamos (los más recientes) que siguen activos")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Prefijo propio de cada ejecución para no chocar con slugs existentes
+        self.run = uuid.uuid4().hex[:6]
+
+        genre_ids = self.create_genres(options['genres'])
+        book_ids = self.create_books(options['books'], genre_ids, options['max_copies'])
+        reader_ids = self.create_readers(options['readers'])
+        if book_ids and reader_ids:
+            self.create_loans(options['loans'], reader_ids, book_ids, options)
+            call_command('recompute_reader_stats', batch_size=self.batch_size, stdout=self.stdout)
+            call_command('rebuild_circulation_stats', stdout=self.stdout)
+            call_command('rebuild_recommendations', stdout=self.stdout)
+        # Ni bulk_create ni update() emiten señales: invalidar la API a mano
+        bump_version('catalogue')
+        self.stdout.write(self.style.SUCCESS("Datos generados"))
+
+    def bulk(self, model, objects):
+        ids = []
+        for batch in batched(objects, self.batch_size):
+            with transaction.atomic():
+                ids.extend(obj.pk for obj in model.objects.bulk_create(batch))
+        self.stdout.write(f"{model.__name__}: {len(ids)} filas")
+        return ids
+
+    def create_genres(self, count):
+        ids = self.bulk(Genre, (
+            Genre(name=f'Género {i} {self.run}', slug=f'genero-{self.run}-{i}')
+            for i in range(count)
+        ))
+        # bulk_create no emite post_save: invalidar el menú a mano
+        bump_version('genres')
+        return ids
+
+    def create_books(self, count, genre_ids, max_copies):
+        rng = self.rng
+
+        def books():
+            for i in range(count):
+                title = ' '.join(rng.choices(WORDS, k=rng.randint(2, 5))).capitalize()
+                yield Book(
+                    title=title,
+                    author=f'{rng.choice(NAMES)} {rng.choice(SURNAMES)}',
+                    genre_id=rng.choice(genre_ids),
+                    publication_year=rng.randint(1900, date.today().year),
+                    copies_total=rng.randint(1, max(max_copies, 1)),
+                    slug=f"{slugify(title)[:32].rstrip('-')}-{self.run}-{i}",
+                )
+
+        return self.bulk(Book, books()) if genre_ids else []
+
+    def create_readers(self, count):
+        rng = self.rng
+        return self.bulk(Reader, (
+            Reader(
+                name=f'{rng.choice(NAMES)} {rng.choice(SURNAMES)}',
+                email=f'lector.{self.run}.{i}@ejemplo.com',
+            )
+            for i in range(count)
+        ))
+
+    def create_loans(self, count, reader_ids, book_ids, options):
+        rng = self.rng
+        today = date.today()
+        active_from = int(count * (1 - options['active_ratio']))
+        max_items = min(options['max_items'], len(book_ids))
+
+        def loans():
+            # Fechas crecientes: los préstamos activos son los más recientes
+            for i in range(count):
+                yield Loan(
+                    reader_id=rng.choice(reader_ids),
+                    created_at=today - timedelta(days=options['days'] * (count - i) // count),
+                    status='active' if i >= active_from else 'returned',
+                )
+
+        with explicit_created_at():
+            loan_ids = self.bulk(Loan, loans())
+
+        def items():
+            for loan_id in loan_ids:
+                for book_id in rng.sample(book_ids, rng.randint(1, max_items)):
+                    yield LoanItem(loan_id=loan_id, book_id=book_id, quantity=1)
+
+        self.bulk(LoanItem, items())
+
+        if active_from < len(loan_ids):
+            active = LoanItem.objects.filter(loan_id__gte=loan_ids[active_from])
+            on_loan = Subquery(
+                active.filter(book=OuterRef('pk')).values('book').annotate(total=Sum('quantity')).values('total')
+            )
+            # Los préstamos se eligieron al azar: si piden más ejemplares de
+            # los que hay, el libro pasa a tener esos ejemplares
+            lent = Book.objects.filter(id__in=active.values('book_id')).update(
+                copies_on_loan=on_loan,
+                copies_total=Greatest(F('copies_total'), on_loan),
+            )
+            self.stdout.write(f"Libros en préstamos activos: {lent}")
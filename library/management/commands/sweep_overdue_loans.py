@@ -0,0 +1,54 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from library.models import Loan
+from library.stats import record_status_change
+
+
+class Command(BaseCommand):
+    help = (
+        "Marca como vencidos ('late') los préstamos activos que superaron "
+        "LIBRARY_LOAN_PERIOD_DAYS, en lotes pequeños. Cada lote es una "
+        "transacción corta que bloquea solo sus filas, así que puede "
+        "ejecutarse cada minuto desde cron. Los préstamos ya procesados dejan "
+        "de ser 'active', de modo que una ejecución interrumpida continúa "
+        "donde quedó la anterior."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Detenerse tras este número de lotes")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Segundos de pausa entre lotes")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)
+        # Recorre el índice (status, created_at, id) desde los más antiguos
+        overdue = (
+            Loan.objects.filter(status='active', created_at__lt=cutoff)
+            .order_by('created_at', 'id')
+        )
+        total = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            with transaction.atomic():
+                # SKIP LOCKED: no espera a filas que otra ejecución o una
+                # devolución en curso tienen bloqueadas.
+                ids = list(
+                    overdue.select_for_update(skip_locked=True)
+                    .values_list('id', flat=True)[:options['batch_size']]
+                )
+                if not ids:
+                    break
+                marked = Loan.objects.filter(id__in=ids, status='active').update(status='late')
+                record_status_change('active', 'late', marked)
+                total += marked
+            batches += 1
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"{total} préstamos marcados como vencidos en {batches} lotes")
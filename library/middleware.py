@@ -0,0 +1,183 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .routers import RoutingState, routing
+
+logger = logging.getLogger('library.queries')
+
+# Contador de la petición en curso. Es una variable de contexto y no un
+# connection.execute_wrapper() por petición porque bajo ASGI el ORM corre
+# en otros hilos, con sus propias conexiones; asgiref copia el contexto a
+# esos hilos, así que el contador los acompaña. count_query se instala en
+# cada conexión nueva (library/signals.py).
+current_counter = contextvars.ContextVar('library_query_counter', default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class QueryBudgetMiddleware:
+    """
+    Cuenta las consultas SQL y su tiempo total por petición.
+
+    El resultado se expone en las cabeceras ``X-DB-Query-Count`` y
+    ``Server-Timing``, se registra como una línea JSON en el logger
+    ``library.queries`` y genera un aviso cuando la vista supera el
+    presupuesto de ``LIBRARY_QUERY_BUDGETS``.
+
+    Como el resto de los middleware del proyecto admite llamadas síncronas
+    y async, para que bajo ASGI las vistas async no pasen por un hilo.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        with count_queries(counter):
+            response = self.get_response(request)
+        return self.report(request, response, counter)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        with count_queries(counter):
+            response = await self.get_response(request)
+        return self.report(request, response, counter)
+
+    def report(self, request, response, counter):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        duration_ms = round(counter.duration * 1000, 2)
+
+        response['X-DB-Query-Count'] = str(counter.count)
+        response['Server-Timing'] = f'db;dur={duration_ms};desc="{counter.count} queries"'
+
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': counter.count,
+            'sql_ms': duration_ms,
+        }
+        budget = get_query_budget(view_name)
+        if budget is not None and counter.count > budget:
+            record['budget'] = budget
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+
+@contextmanager
+def count_queries(counter):
+    token = current_counter.set(counter)
+    try:
+        yield
+    finally:
+        current_counter.reset(token)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def get_query_budget(view_name):
+    budgets = getattr(settings, 'LIBRARY_QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'LIBRARY_QUERY_BUDGET_DEFAULT', None))
+
+
+class LoanSelectionMiddleware:
+    """Escribe en la respuesta la cookie pendiente de la selección de préstamo."""
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.write_cookie(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.write_cookie(request, await self.get_response(request))
+
+    def write_cookie(self, request, response):
+        store = getattr(request, '_selection_store', None)
+        if store is not None:
+            store.update_response(response)
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Fija al primario las lecturas de quien acaba de escribir.
+
+    Cada petición lleva su propio ``RoutingState``; si durante ella se
+    escribió algo de library (un préstamo, una devolución...), la respuesta
+    deja una cookie que durante ``LIBRARY_PRIMARY_STICKY_SECONDS`` manda
+    también sus lecturas al primario, para que vea sus cambios aunque las
+    réplicas vayan retrasadas.
+    """
+    cookie_name = 'library_primary'
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        with routing(state):
+            response = self.get_response(request)
+        return self.write_cookie(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        with routing(state):
+            response = await self.get_response(request)
+        return self.write_cookie(state, response)
+
+    def write_cookie(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=getattr(settings, 'LIBRARY_PRIMARY_STICKY_SECONDS', 10),
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
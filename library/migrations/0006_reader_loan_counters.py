@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:22
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Reader = apps.get_model('library', 'Reader')
+    Loan = apps.get_model('library', 'Loan')
+    loans = Loan.objects.filter(reader=OuterRef('pk')).values('reader')
+    Reader.objects.update(
+        active_loans_count=Coalesce(
+            Subquery(loans.annotate(n=Count('id', filter=~Q(status='returned'))).values('n')), 0
+        ),
+        last_loan_date=Subquery(loans.annotate(last=Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reader',
+            name='active_loans_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reader',
+            name='last_loan_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
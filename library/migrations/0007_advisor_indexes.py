@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_reader_loan_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['genre', 'available', 'id'], name='book_genre_available_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reader',
+            index=models.Index(fields=['email'], name='reader_email_idx'),
+        ),
+    ]
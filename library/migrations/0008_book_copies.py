@@ -0,0 +1,62 @@
+from django.db import migrations, models
+
+
+def copies_from_available(apps, schema_editor):
+    # Hasta ahora cada libro era un único ejemplar: si no estaba disponible,
+    # ese ejemplar está prestado
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(available=False).update(copies_on_loan=1)
+
+
+def available_from_copies(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(copies_on_loan__gte=models.F('copies_total')).update(available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_advisor_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_genre_available_id_idx',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(copies_from_available, available_from_copies),
+        migrations.RemoveField(
+            model_name='book',
+            name='available',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='available',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=models.Q(('copies_on_loan__lt', models.F('copies_total'))),
+                output_field=models.BooleanField(),
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(
+                condition=models.Q(('copies_on_loan__lte', models.F('copies_total'))),
+                name='book_copies_on_loan_lte_total',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['genre', 'available', 'id'], name='book_genre_available_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:56
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_book_copies'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reader',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='reader_upper_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reader',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='text_pattern_ops'), name='reader_upper_email_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_reader_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateField()),
+                ('archived_at', models.DateField(auto_now_add=True)),
+                ('reader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='library.reader')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedLoanItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_title', models.CharField(max_length=200)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='library.book')),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='library.archivedloan')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['created_at', 'id'], name='archivedloan_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_circulation_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-loans', '-id'], name='bookrec_book_loans_id_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'recommended'), name='bookrecommendation_book_recommended_uniq')],
+            },
+        ),
+    ]
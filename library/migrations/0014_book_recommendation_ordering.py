@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_task_queue'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bookrecommendation',
+            name='bookrec_book_loans_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='bookrecommendation',
+            index=models.Index(fields=['book', '-loans', '-recommended'], name='bookrec_book_loans_rec_idx'),
+        ),
+    ]
@@ -1,9 +1,53 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Coalesce, Greatest, Upper
+from django.utils import timezone
+from .cache import catalogue_changed
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from django.db.models.manager import RelatedManager
 
+class BooksUnavailable(Exception):
+    """
+    Algún libro de la selección ya no está disponible: ``books`` son los
+    que no tienen ejemplares suficientes y ``missing_ids`` los ids que ya
+    no existen (libro eliminado, cookie vieja).
+    """
+
+    def __init__(self, books, missing_ids=()):
+        self.books = books
+        self.missing_ids = list(missing_ids)
+        super().__init__(', '.join(book.title for book in books))
+
+
+class CounterFieldsModel(models.Model):
+    """
+    Modelo con contadores que solo cambian con UPDATE condicionales
+    (``F('campo') + n``). Un ``save()`` normal sobre una fila existente
+    escribe los demás campos pero no ``counter_fields``: el valor cargado
+    en memoria puede haber quedado viejo mientras tanto.
+    """
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
 # Create your models here.
 class Genre(models.Model):
     name = models.CharField(max_length=200)
@@ -12,31 +56,99 @@ class Genre(models.Model):
     def __str__(self):
         return self.name
     
-class Book(models.Model):
+class Book(CounterFieldsModel):
     title =  models.CharField(max_length=200)
     author = models.CharField(max_length=200)
     genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
     publication_year = models.PositiveIntegerField()
-    available = models.BooleanField(default=True)
+    # Ejemplares: los préstamos reservan y liberan copias con UPDATE
+    # condicionales sobre copies_on_loan (ver Loan.checkout).
+    copies_total = models.PositiveIntegerField(default=1)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+    # Derivado de los ejemplares; lo usan los filtros del catálogo y el admin
+    available = models.GeneratedField(
+        expression=Q(copies_on_loan__lt=F('copies_total')),
+        output_field=models.BooleanField(),
+        db_persist=True,
+    )
     slug = models.SlugField(unique=True, blank=True)
+    # Vector de búsqueda calculado por PostgreSQL en cada INSERT/UPDATE;
+    # el título pesa más que el autor en el ranking.
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config='spanish')
+            + SearchVector('author', weight='B', config='spanish')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Orden estable del catálogo para la paginación por cursor
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['genre', 'title', 'id'], name='book_genre_title_id_idx'),
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            # Filtros del admin por género y disponibilidad, ordenados por id
+            models.Index(fields=['genre', 'available', 'id'], name='book_genre_available_id_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(copies_on_loan__lte=F('copies_total')),
+                name='book_copies_on_loan_lte_total',
+            ),
+        ]
+
+    counter_fields = ('copies_on_loan',)
 
     def __str__(self):
         return self.title
 
+    def clean(self):
+        # La restricción de la base no llega al formulario: copies_on_loan
+        # no es editable y Django no valida restricciones sobre campos
+        # excluidos
+        if self.copies_total is not None and self.copies_total < self.copies_on_loan:
+            raise ValidationError({
+                'copies_total': f'Hay {self.copies_on_loan} ejemplares prestados: el total no puede ser menor.',
+            })
+
+    @property
+    def copies_available(self):
+        return self.copies_total - self.copies_on_loan
+
     @property
     def is_available(self):
-        return self.available
+        return self.copies_available > 0
 
-class Reader(models.Model):
+class Reader(CounterFieldsModel):
     name = models.CharField(max_length=200)
     email = models.EmailField()
+    # Contadores mantenidos por Loan.checkout y Loan.mark_returned (save()
+    # no los escribe); el comando recompute_reader_stats los recalcula,
+    # contando también el archivo, si se desajustan.
+    active_loans_count = models.PositiveIntegerField(default=0, editable=False)
+    last_loan_date = models.DateField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # CreateLoanView busca al lector por email en cada préstamo
+            models.Index(fields=['email'], name='reader_email_idx'),
+            # Búsqueda del admin: prefijo del nombre y email sin distinguir
+            # mayúsculas (UPPER(...) LIKE 'X%' y UPPER(...) = 'X')
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='reader_upper_name_idx'),
+            models.Index(OpClass(Upper('email'), name='text_pattern_ops'), name='reader_upper_email_idx'),
+        ]
+
+    counter_fields = ('active_loans_count', 'last_loan_date')
+
+    def __str__(self):
+        return f'{self.name} <{self.email}>'
+
+    def outstanding_loans(self):
+        """Préstamos sin devolver, activos o vencidos; sin consultar la base."""
+        return self.active_loans_count
 
-    def active_loans(self):
-        return Loan.objects.filter(reader=self, status='active').count()
-    
-    def last_loan(self):
-        return Loan.objects.filter(reader=self).order_by('-created_at').first()
-    
 class Loan(models.Model):
     STATUS_CHOICES = [
         ('active', 'Activo'),
@@ -48,22 +160,317 @@ class Loan(models.Model):
     created_at = models.DateField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='loan_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='loan_status_created_id_idx'),
+        ]
+
     if TYPE_CHECKING:
         items: 'RelatedManager[LoanItem]'
 
+    def __str__(self):
+        return f'Préstamo #{self.pk} de {self.reader}'
+
     @property
     def is_active(self):
         return self.status == 'active'
+
+    @property
+    def due_date(self):
+        return self.created_at + timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)
     
     def total_books(self):
-        return sum(item.quantity for item in self.items.all())
+        # LoanListView ya lo anota en la consulta principal
+        if hasattr(self, 'books_total'):
+            return self.books_total
+        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
     
+    @classmethod
+    def checkout(cls, reader, selection):
+        """
+        Crea el préstamo de toda la selección como una sola unidad.
+
+        Los ejemplares se reservan con un único UPDATE condicional que suma
+        a ``copies_on_loan`` la cantidad pedida de cada libro solo si quedan
+        copias suficientes; la comprobación y la reserva ocurren en la misma
+        sentencia, sin SELECT ... FOR UPDATE previo. Si alguna fila no se
+        actualizó (otro préstamo se llevó las copias), se deshace todo y se
+        lanza ``BooksUnavailable``.
+
+        Las estadísticas, las recomendaciones y el correo al lector se
+        encolan como tareas en la misma transacción (library/tasks.py).
+        """
+        from .tasks import enqueue
+
+        quantities = {book_id: item.quantity for book_id, item in selection.items.items()}
+        if not quantities:
+            # Sin libros, Q() abarcaría todo el catálogo en el UPDATE
+            raise ValueError('La selección está vacía')
+        book_ids = list(quantities)
+        enough = Q()
+        for book_id, quantity in quantities.items():
+            enough |= Q(id=book_id, copies_on_loan__lte=F('copies_total') - quantity)
+        reservable = Book.objects.filter(enough)
+        try:
+            with transaction.atomic():
+                loan = cls.objects.create(reader=reader)
+                LoanItem.objects.bulk_create([
+                    LoanItem(loan=loan, book_id=book_id, quantity=quantity)
+                    for book_id, quantity in quantities.items()
+                ])
+                Reader.objects.filter(pk=reader.pk).update(
+                    active_loans_count=F('active_loans_count') + 1,
+                    last_loan_date=loan.created_at,
+                )
+                # La reserva va al final: las filas de los libros quedan
+                # bloqueadas el menor tiempo posible hasta el COMMIT
+                reserved = reservable.update(copies_on_loan=F('copies_on_loan') + Case(
+                    *[When(id=book_id, then=quantity) for book_id, quantity in quantities.items()],
+                    output_field=models.PositiveIntegerField(),
+                ))
+                if reserved != len(book_ids):
+                    raise BooksUnavailable([])
+                scopes = Book.objects.filter(id__in=book_ids).values_list('id', 'genre_id', 'slug')
+                # update() no emite señales: los ejemplares libres cambiaron.
+                # Se invalida en el momento, no en una tarea: quien presta
+                # tiene que ver enseguida los ejemplares que quedan.
+                catalogue_changed(
+                    genre_ids=[genre_id for _, genre_id, _ in scopes],
+                    book_slugs=[slug for _, _, slug in scopes],
+                )
+                # Los contadores del día son filas que comparten todos los
+                # préstamos: se actualizan en el worker, no aquí
+                enqueue('record_checkout', day=loan.created_at.isoformat(), books=[
+                    [book_id, genre_id, quantities[book_id]] for book_id, genre_id, _ in scopes
+                ])
+                if len(book_ids) > 1:
+                    enqueue('record_recommendations', book_ids=book_ids)
+                enqueue('send_loan_email', loan_id=loan.pk, template='loan_created')
+        except BooksUnavailable:
+            raise BooksUnavailable(*cls._unavailable_books(quantities))
+        return loan
+
+    @staticmethod
+    def _unavailable_books(quantities):
+        """
+        Libros de los que no quedan ejemplares suficientes para
+        ``quantities`` e ids que ya no existen, en una consulta.
+        """
+        books = Book.objects.filter(id__in=quantities).only('title', 'copies_total', 'copies_on_loan')
+        found = {book.id: book for book in books}
+        short = [book for book_id, book in found.items() if book.copies_available < quantities[book_id]]
+        return short, [book_id for book_id in quantities if book_id not in found]
+
     def mark_returned(self):
+        """
+        Marca el préstamo como devuelto y libera sus libros.
+
+        El UPDATE solo afecta al préstamo si aún no estaba devuelto, así que
+        de dos devoluciones simultáneas solo una sigue adelante. Se prueba
+        primero con 'active' y luego con 'late' para saber de qué estado
+        salió (lo necesitan las estadísticas, que se encolan como tarea
+        junto con el correo al lector). Devuelve ``False`` si el préstamo ya
+        había sido devuelto.
+        """
+        from .tasks import enqueue
+
+        with transaction.atomic():
+            for previous in ('active', 'late'):
+                if Loan.objects.filter(pk=self.pk, status=previous).update(status='returned'):
+                    break
+            else:
+                return False
+            items = LoanItem.objects.filter(loan=self.pk)
+            books = Book.objects.filter(id__in=items.values('book_id'))
+            scopes = list(books.values_list('genre_id', 'slug'))
+            returned = items.filter(book=models.OuterRef('pk')).values('book').annotate(
+                total=models.Sum('quantity'),
+            ).values('total')
+            books.update(copies_on_loan=Greatest(
+                F('copies_on_loan') - Coalesce(models.Subquery(returned), 0), 0,
+            ))
+            catalogue_changed(
+                genre_ids=[genre_id for genre_id, _ in scopes],
+                book_slugs=[slug for _, slug in scopes],
+            )
+            Reader.objects.filter(pk=self.reader_id).update(
+                active_loans_count=Greatest(F('active_loans_count') - 1, 0),
+            )
+            enqueue('record_status_change', previous=previous, new='returned')
+            enqueue('send_loan_email', loan_id=self.pk, template='loan_returned')
         self.status = 'returned'
-        self.save()
+        return True
+
+    @classmethod
+    def archive(cls, loans, limit=None, skip_locked=True):
+        """
+        Traslada al archivo los préstamos devueltos de ``loans``, con sus
+        ítems, y los borra de las tablas activas en una sola transacción.
+
+        Toma como mucho ``limit`` préstamos, de los más antiguos a los más
+        nuevos. Con ``skip_locked`` salta las filas que otro proceso tiene
+        bloqueadas en lugar de esperarlas. Devuelve cuántos archivó.
+        """
+        with transaction.atomic():
+            rows = (
+                loans.filter(status='returned')
+                .select_for_update(skip_locked=skip_locked)
+                .order_by('created_at', 'id')
+                .values_list('id', 'reader_id', 'created_at')
+            )
+            rows = list(rows[:limit] if limit else rows)
+            if not rows:
+                return 0
+            ids = [loan_id for loan_id, _, _ in rows]
+            items = LoanItem.objects.filter(loan_id__in=ids).values_list(
+                'loan_id', 'book_id', 'book__title', 'quantity',
+            )
+            ArchivedLoan.objects.bulk_create([
+                ArchivedLoan(id=loan_id, reader_id=reader_id, created_at=created_at)
+                for loan_id, reader_id, created_at in rows
+            ])
+            ArchivedLoanItem.objects.bulk_create([
+                ArchivedLoanItem(loan_id=loan_id, book_id=book_id, book_title=title, quantity=quantity)
+                for loan_id, book_id, title, quantity in items
+            ])
+            # Borra también los ítems (CASCADE)
+            cls.objects.filter(id__in=ids).delete()
+        return len(ids)
 
 class LoanItem(models.Model):
     loan = models.ForeignKey(Loan, related_name='items', on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.PROTECT)
     quantity = models.PositiveBigIntegerField(default=1)      
 
+
+
+class ArchivedLoan(models.Model):
+    """
+    Préstamo devuelto trasladado por Loan.archive fuera de las tablas
+    activas. Conserva el id original.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    reader = models.ForeignKey(Reader, on_delete=models.CASCADE)
+    created_at = models.DateField()
+    archived_at = models.DateField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='archivedloan_created_id_idx'),
+        ]
+
+    if TYPE_CHECKING:
+        items: 'RelatedManager[ArchivedLoanItem]'
+
+    def __str__(self):
+        return f'Préstamo archivado #{self.pk}'
+
+
+class ArchivedLoanItem(models.Model):
+    loan = models.ForeignKey(ArchivedLoan, related_name='items', on_delete=models.CASCADE)
+    # Sin restricción en la base: borrar un libro no toca su historial,
+    # que guarda el título del momento del préstamo
+    book = models.ForeignKey(
+        Book, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+',
+    )
+    book_title = models.CharField(max_length=200)
+    quantity = models.PositiveIntegerField(default=1)
+
+
+# ESTADÍSTICAS DE CIRCULACIÓN
+# Resúmenes que incrementan las tareas encoladas por Loan.checkout y
+# Loan.mark_returned y el propio sweep_overdue_loans (library/stats.py); el
+# comando rebuild_circulation_stats los recalcula desde los préstamos.
+
+class DailyCirculation(models.Model):
+    day = models.DateField(unique=True)
+    loans = models.PositiveIntegerField(default=0)
+    copies = models.PositiveIntegerField(default=0)
+
+
+class DailyBookCirculation(models.Model):
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    loans = models.PositiveIntegerField(default=0)
+    copies = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book'], name='dailybookcirculation_day_book_uniq'),
+        ]
+
+
+class DailyGenreCirculation(models.Model):
+    day = models.DateField()
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='+')
+    loans = models.PositiveIntegerField(default=0)
+    copies = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre'], name='dailygenrecirculation_day_genre_uniq'),
+        ]
+
+
+class LoanStatusCount(models.Model):
+    """Préstamos sin devolver por estado ('active' y 'late')."""
+    status = models.CharField(max_length=20, primary_key=True)
+    count = models.IntegerField(default=0)
+
+
+# RECOMENDACIONES
+# "Otros lectores también se llevaron": para cada libro, los libros que
+# más veces compartieron préstamo con él. Solo se guardan los primeros de
+# cada libro (library/recommendations.py); el detalle los lee con una
+# consulta por el índice (book, -loans, -recommended).
+
+class BookRecommendation(models.Model):
+    # Ya cubierto por la restricción única y el índice, que empiezan por book
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+', db_index=False)
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    # Préstamos en los que aparecen los dos libros
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'recommended'], name='bookrecommendation_book_recommended_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-loans', '-recommended'], name='bookrec_book_loans_rec_idx'),
+        ]
+
+
+# TAREAS EN SEGUNDO PLANO
+# Bandeja de salida transaccional: los préstamos encolan aquí sus efectos
+# secundarios (estadísticas, recomendaciones, correos) en su misma
+# transacción y el comando run_tasks los ejecuta (library/tasks.py).
+
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('running', 'En curso'),
+        ('failed', 'Fallida'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Pendiente: cuándo puede ejecutarse; en curso: cuándo vence la
+    # reserva del worker y otro puede retomarla
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Solo las tareas por hacer: las fallidas no engordan el índice
+            models.Index(
+                fields=['run_after', 'id'], name='task_due_idx',
+                condition=Q(status__in=['pending', 'running']),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
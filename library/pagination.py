@@ -0,0 +1,155 @@
+import base64
+import json
+
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    raw = json.dumps({"k": list(values), "d": direction}, separators=(",", ":"), cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction = data["k"], data["d"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in ("n", "p") or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values, direction
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginación por cursor (keyset) sobre un orden estable.
+
+    En lugar de OFFSET filtra por la posición del último registro visto,
+    así que el costo de una página no depende de su profundidad. El último
+    campo de ``ordering`` debe ser único (normalmente ``id``); los campos
+    con prefijo ``-`` se recorren en orden descendente.
+    """
+
+    def __init__(self, queryset, per_page, ordering=("id",)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip("-") for field in self.ordering)
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def _after(self, values, backwards=False):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            descending = self.ordering[i].startswith("-")
+            lookup = "lt" if descending != backwards else "gt"
+            step = Q(**{f"{field}__{lookup}": values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_field: prev_value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith("-") else f"-{field}" for field in self.ordering]
+
+    def page_queryset(self, cursor=None):
+        """Consulta de una página: ``per_page + 1`` filas para saber si hay más."""
+        values, direction = decode_cursor(cursor) if cursor else (None, "n")
+        if values is not None and len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+
+        if direction == "p":
+            qs = self.queryset.order_by(*self._reversed_ordering())
+            qs = qs.filter(self._after(values, backwards=True))
+        else:
+            qs = self.queryset.order_by(*self.ordering)
+            if values is not None:
+                qs = qs.filter(self._after(values))
+        return qs[: self.per_page + 1], values, direction
+
+    def page(self, cursor=None):
+        qs, values, direction = self.page_queryset(cursor)
+        return self._build_page(list(qs), values, direction)
+
+    async def apage(self, cursor=None):
+        qs, values, direction = self.page_queryset(cursor)
+        return self._build_page([row async for row in qs], values, direction)
+
+    def _build_page(self, rows, values, direction):
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+
+        if direction == "p":
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = encode_cursor(self._key(rows[-1]), "n") if rows and has_next else None
+        previous_cursor = encode_cursor(self._key(rows[0]), "p") if rows and has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def estimate_count(queryset):
+    """Filas que el planificador de PostgreSQL espera para ``queryset``."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginador por OFFSET que no cuenta filas cuando son demasiadas.
+
+    Pregunta primero al planificador cuántas filas espera (un EXPLAIN, sin
+    recorrer la tabla). Por debajo de ``exact_limit`` hace el ``COUNT(*)``
+    de siempre; por encima usa la estimación, que basta para numerar las
+    páginas de un listado de millones de filas.
+    """
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, "query"):
+            return super().count
+        estimate = estimate_count(self.object_list)
+        if estimate < self.exact_limit:
+            return super().count
+        return estimate
@@ -0,0 +1,120 @@
+from itertools import permutations
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .cache import books_changed
+from .models import ArchivedLoanItem, Book, BookRecommendation, LoanItem
+from .stats import increment
+
+# Por libro se guardan más recomendaciones de las que se muestran: un
+# emparejamiento nuevo entra con 1 préstamo y necesita sitio para subir
+KEPT_FACTOR = 3
+# Orden de las recomendaciones de un libro, también al recortar y al
+# reconstruir: a igualdad de préstamos desempata el id del recomendado,
+# así ambos caminos guardan y muestran las mismas
+ORDERING = ('-loans', '-recommended')
+REBUILD_CHUNK_SIZE = 5000
+
+
+def shown_per_book():
+    return getattr(settings, 'LIBRARY_RECOMMENDATIONS', 5)
+
+
+def kept_per_book():
+    return shown_per_book() * KEPT_FACTOR
+
+
+def recommendations_for(book):
+    """Libros que más veces se prestaron junto con ``book``: una consulta por índice."""
+    rows = (
+        BookRecommendation.objects.filter(book=book)
+        .select_related('recommended')
+        .only('recommended__title', 'recommended__slug', 'recommended__author')
+        .order_by(*ORDERING)[:shown_per_book()]
+    )
+    return [row.recommended for row in rows]
+
+
+async def arecommendations_for(book):
+    rows = (
+        BookRecommendation.objects.filter(book=book)
+        .select_related('recommended')
+        .only('recommended__title', 'recommended__slug', 'recommended__author')
+        .order_by(*ORDERING)[:shown_per_book()]
+    )
+    return [row.recommended async for row in rows]
+
+
+def record_loan(book_ids):
+    """
+    Suma un préstamo a cada par de libros de ``book_ids`` y recorta sus
+    listas a ``kept_per_book()``. Lo ejecuta la tarea que encola
+    Loan.checkout, fuera de la transacción del préstamo; el detalle
+    cacheado de esos libros se invalida al confirmarse.
+    """
+    book_ids = sorted(set(book_ids))
+    if len(book_ids) < 2:
+        return
+    with transaction.atomic():
+        increment(BookRecommendation, ['book', 'recommended'], [
+            {'book': book_id, 'recommended': other_id, 'loans': 1}
+            for book_id, other_id in permutations(book_ids, 2)
+        ])
+        ranked = BookRecommendation.objects.filter(book__in=book_ids).annotate(
+            rank=Window(RowNumber(), partition_by=F('book'), order_by=[F('loans').desc(), F('recommended').desc()]),
+        ).filter(rank__gt=kept_per_book())
+        BookRecommendation.objects.filter(id__in=ranked.values('id')).delete()
+        books_changed(Book.objects.filter(id__in=book_ids).values_list('slug', flat=True))
+
+
+def rebuild(chunk_size=REBUILD_CHUNK_SIZE):
+    """
+    Recalcula las recomendaciones desde los préstamos activos y archivados.
+
+    Recorre los libros por tramos de ``chunk_size`` ids: cada tramo se
+    agrega en PostgreSQL, se sustituye en su propia transacción y solo sus
+    ``kept_per_book()`` primeras filas por libro salen de la base, así que
+    la memoria no depende del tamaño del historial. Al confirmarse cada
+    tramo se invalida el detalle cacheado de sus libros. Devuelve cuántas
+    filas escribió.
+    """
+    connection = connections[router.db_for_write(BookRecommendation)]
+    quote = connection.ops.quote_name
+    history = ' UNION ALL '.join(
+        f"SELECT loan_id, book_id FROM {quote(model._meta.db_table)}"
+        for model in (LoanItem, ArchivedLoanItem)
+    )
+    # Los préstamos archivados pueden ser de libros ya eliminados
+    book_table = quote(Book._meta.db_table)
+    sql = (
+        f"INSERT INTO {quote(BookRecommendation._meta.db_table)} (book_id, recommended_id, loans) "
+        f"SELECT book_id, recommended_id, loans FROM ("
+        f"SELECT a.book_id, b.book_id AS recommended_id, COUNT(DISTINCT a.loan_id) AS loans, "
+        f"ROW_NUMBER() OVER (PARTITION BY a.book_id "
+        f"ORDER BY COUNT(DISTINCT a.loan_id) DESC, b.book_id DESC) AS rank "
+        f"FROM ({history}) a JOIN ({history}) b ON b.loan_id = a.loan_id AND b.book_id <> a.book_id "
+        f"WHERE a.book_id BETWEEN %s AND %s "
+        f"AND a.book_id IN (SELECT id FROM {book_table}) "
+        f"AND b.book_id IN (SELECT id FROM {book_table}) "
+        f"GROUP BY a.book_id, b.book_id"
+        f") ranked WHERE rank <= %s"
+    )
+    written = 0
+    last = 0
+    while True:
+        books = list(
+            Book.objects.filter(id__gt=last).order_by('id')
+            .values_list('id', 'slug')[:chunk_size]
+        )
+        if not books:
+            return written
+        first, last = books[0][0], books[-1][0]
+        with transaction.atomic(using=connection.alias):
+            BookRecommendation.objects.filter(book_id__gte=first, book_id__lte=last).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [first, last, kept_per_book()])
+                written += cursor.rowcount
+            books_changed(slug for _, slug in books)
@@ -0,0 +1,144 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('library.routers')
+
+# Estado de enrutamiento de la petición en curso (ver ReplicaStickinessMiddleware).
+# Como el contador de consultas, es una variable de contexto: bajo ASGI
+# acompaña al ORM a los hilos donde corre.
+current_routing = contextvars.ContextVar('library_db_routing', default=None)
+
+# Última comprobación de cada réplica: alias -> (momento, utilizable)
+_replica_health = {}
+
+LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class RoutingState:
+    """``pinned``: leer del primario; ``wrote``: hubo escrituras de library."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def routing(state):
+    token = current_routing.set(state)
+    try:
+        yield state
+    finally:
+        current_routing.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Lee del primario dentro del bloque. Para lo que se guarda en la caché:
+    al confirmarse un cambio se incrementa la versión, y un fragmento
+    regenerado desde una réplica retrasada quedaría guardado con datos
+    viejos bajo la versión nueva hasta caducar.
+    """
+    outer = current_routing.get()
+    with routing(RoutingState(pinned=True)) as state:
+        yield
+    if outer is not None and state.wrote:
+        outer.pinned = outer.wrote = True
+
+
+def replica_aliases():
+    return list(getattr(settings, 'LIBRARY_READ_REPLICAS', []))
+
+
+def replica_lag(alias):
+    """Segundos de retraso de una réplica (0 si está al día o no es réplica)."""
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def is_usable(alias):
+    """
+    Si la réplica responde y su retraso no supera
+    ``LIBRARY_REPLICA_MAX_LAG_SECONDS``. El resultado se guarda en memoria
+    durante ``LIBRARY_REPLICA_CHECK_SECONDS`` para no consultar el retraso
+    en cada lectura.
+    """
+    now = time.monotonic()
+    checked = _replica_health.get(alias)
+    if checked is not None and now - checked[0] < getattr(settings, 'LIBRARY_REPLICA_CHECK_SECONDS', 5):
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+        usable = lag <= getattr(settings, 'LIBRARY_REPLICA_MAX_LAG_SECONDS', 10)
+        if not usable:
+            logger.warning("Réplica %s retrasada %.1f s: se lee del primario", alias, lag)
+    except DatabaseError as exc:
+        logger.warning("Réplica %s no disponible: %s", alias, exc)
+        connections[alias].close()
+        usable = False
+    _replica_health[alias] = (now, usable)
+    return usable
+
+
+def reset_replica_health():
+    _replica_health.clear()
+
+
+class ReplicaRouter:
+    """
+    Lecturas de library en las réplicas de ``LIBRARY_READ_REPLICAS``,
+    escrituras en el primario (``default``).
+
+    Se lee del primario cuando no hay réplicas utilizables, dentro de una
+    transacción (para ver sus propias escrituras y una sola instantánea) y
+    cuando el estado de la petición está fijado al primario: después de
+    una escritura propia, en la misma petición y, mediante la cookie de
+    ReplicaStickinessMiddleware, durante ``LIBRARY_PRIMARY_STICKY_SECONDS``.
+    Fuera de una petición (comandos) la primera escritura fija al primario
+    el resto del proceso.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'library':
+            return None
+        state = current_routing.get()
+        if state is not None and state.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in replica_aliases() if is_usable(alias)]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'library':
+            return None
+        state = current_routing.get()
+        if state is None:
+            current_routing.set(RoutingState(pinned=True))
+        else:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas son copias del primario: los objetos pueden mezclarse
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas reciben el esquema por replicación
+        if db in replica_aliases():
+            return False
+        return None
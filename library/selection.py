@@ -1,51 +1,199 @@
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
 
 class LoanSelectionItem:
-    def __init__(self, book_id, title, quantity=1):
+    def __init__(self, book_id, quantity=1, title=None):
         self.book_id = book_id
-        self.title = title
         self.quantity = quantity
+        # Se resuelve al mostrar la selección (LoanSelection.load_titles)
+        self.title = title
 
-    def to_dict(self):
-        return {
-            "book_id": self.book_id,
-            "title": self.title,
-            "quantity": self.quantity,
-        }
-
-    @staticmethod
-    def from_dict(data):
-        return LoanSelectionItem(
-            book_id=data["book_id"],
-            title=data["title"],
-            quantity=data["quantity"]
-        )
 
 class LoanSelection:
+    # Formato compacto: [versión, [[book_id, cantidad], ...]]
+    VERSION = 2
+
     def __init__(self):
         self.items = {}
+        self._count = 0
 
     def add_book(self, book, quantity=1):
-        if book.id in self.items:
-            self.items[book.id].quantity += quantity
+        self.add_book_id(book.id, quantity, title=book.title)
+
+    def add_book_id(self, book_id, quantity=1, title=None):
+        if book_id in self.items:
+            self.items[book_id].quantity += quantity
         else:
-            self.items[book.id] = LoanSelectionItem(book.id, book.title, quantity)
+            self.items[book_id] = LoanSelectionItem(book_id, quantity, title)
+        self._count += quantity
+
+    def set_quantity(self, book_id, quantity):
+        item = self.items[book_id]
+        self._count += quantity - item.quantity
+        item.quantity = quantity
 
     def remove_book(self, book_id):
-        self.items.pop(book_id, None)
+        item = self.items.pop(book_id, None)
+        if item is not None:
+            self._count -= item.quantity
 
     def clear(self):
         self.items = {}
+        self._count = 0
 
     def __len__(self):
-        return sum(item.quantity for item in self.items.values())
-
-    def to_dict(self):
-        return {bid: item.to_dict() for bid, item in self.items.items()}
-
-    @staticmethod
-    def from_dict(data):
-        sel = LoanSelection()
-        for item_dict in data.values():
-            item = LoanSelectionItem.from_dict(item_dict)
-            sel.items[item.book_id] = item
-        return sel    
\ No newline at end of file
+        return self._count
+
+    def load_titles(self):
+        """Obtiene los títulos de todos los libros con una sola consulta."""
+        from .models import Book
+
+        missing = [bid for bid, item in self.items.items() if item.title is None]
+        if missing:
+            titles = dict(Book.objects.filter(id__in=missing).values_list('id', 'title'))
+            for bid in missing:
+                self.items[bid].title = titles.get(bid, '')
+        return self
+
+    async def aload_titles(self):
+        from .models import Book
+
+        missing = [bid for bid, item in self.items.items() if item.title is None]
+        if missing:
+            titles = {bid: title async for bid, title in Book.objects.filter(id__in=missing).values_list('id', 'title')}
+            for bid in missing:
+                self.items[bid].title = titles.get(bid, '')
+        return self
+
+    def as_json(self):
+        """Estado de la selección para la API JSON (requiere títulos cargados)."""
+        return {
+            "items": [
+                {"book_id": item.book_id, "title": item.title, "quantity": item.quantity}
+                for item in self.items.values()
+            ],
+            "count": self._count,
+        }
+
+    def encode(self):
+        return [self.VERSION, [[bid, item.quantity] for bid, item in self.items.items()]]
+
+    @classmethod
+    def decode(cls, data):
+        sel = cls()
+        if isinstance(data, list) and data and data[0] == cls.VERSION:
+            for book_id, quantity in data[1]:
+                sel.add_book_id(int(book_id), int(quantity))
+        elif isinstance(data, dict):
+            # Versión 1: {"<id>": {"book_id", "title", "quantity"}}
+            for item in data.values():
+                sel.add_book_id(int(item["book_id"]), int(item["quantity"]))
+        return sel
+
+
+class SelectionStore:
+    """
+    Dónde se guarda la selección de préstamo de cada visitante.
+
+    ``LIBRARY_SELECTION_STORE`` elige la clase. Las que usan cookies dejan
+    la cookie pendiente y ``LoanSelectionMiddleware`` la escribe en la
+    respuesta.
+    """
+    cookie_name = 'loan_selection'
+    salt = 'library.selection'
+
+    def __init__(self, request):
+        self.request = request
+        self.pending_cookie = None
+
+    def load(self):
+        raise NotImplementedError
+
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    def save(self, selection):
+        raise NotImplementedError
+
+    def update_response(self, response):
+        if self.pending_cookie is not None:
+            response.set_signed_cookie(
+                self.cookie_name, self.pending_cookie, salt=self.salt,
+                max_age=settings.SESSION_COOKIE_AGE, httponly=True, samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+
+
+class SessionSelectionStore(SelectionStore):
+    """Guarda la selección en la sesión (una escritura en BD por cambio)."""
+    session_key = 'loan_selection'
+
+    def load(self):
+        return LoanSelection.decode(self.request.session.get(self.session_key))
+
+    async def aload(self):
+        return LoanSelection.decode(await self.request.session.aget(self.session_key))
+
+    def save(self, selection):
+        self.request.session[self.session_key] = selection.encode()
+
+
+class SignedCookieSelectionStore(SelectionStore):
+    """Guarda la selección firmada en una cookie propia; no usa el servidor."""
+
+    def load(self):
+        raw = self.request.get_signed_cookie(self.cookie_name, None, salt=self.salt)
+        try:
+            return LoanSelection.decode(json.loads(raw) if raw else None)
+        except (ValueError, TypeError):
+            return LoanSelection()
+
+    async def aload(self):
+        # Solo lee la cookie de la petición: no hay E/S que esperar
+        return self.load()
+
+    def save(self, selection):
+        self.pending_cookie = json.dumps(selection.encode(), separators=(',', ':'))
+
+
+class CacheSelectionStore(SelectionStore):
+    """Guarda la selección en la caché; la cookie solo lleva un identificador."""
+    cookie_name = 'loan_selection_id'
+
+    def selection_id(self):
+        raw = self.request.get_signed_cookie(self.cookie_name, None, salt=self.salt)
+        return raw or self.pending_cookie
+
+    def load(self):
+        selection_id = self.selection_id()
+        if not selection_id:
+            return LoanSelection()
+        return LoanSelection.decode(cache.get(f'library:selection:{selection_id}'))
+
+    async def aload(self):
+        selection_id = self.selection_id()
+        if not selection_id:
+            return LoanSelection()
+        return LoanSelection.decode(await cache.aget(f'library:selection:{selection_id}'))
+
+    def save(self, selection):
+        selection_id = self.selection_id()
+        if not selection_id:
+            selection_id = self.pending_cookie = uuid.uuid4().hex
+        cache.set(f'library:selection:{selection_id}', selection.encode(), settings.SESSION_COOKIE_AGE)
+
+
+def get_selection_store(request):
+    store = getattr(request, '_selection_store', None)
+    if store is None:
+        store_class = import_string(getattr(
+            settings, 'LIBRARY_SELECTION_STORE', 'library.selection.SignedCookieSelectionStore'
+        ))
+        store = request._selection_store = store_class(request)
+    return store
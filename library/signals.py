@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_version, catalogue_changed
+from .middleware import count_query
+from .models import Book, Genre
+
+
+@receiver([post_save, post_delete], sender=Genre)
+def invalidate_genres(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('genres'))
+    catalogue_changed(genre_ids=[kwargs['instance'].pk])
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_scope(sender, instance, using, **kwargs):
+    # Si el libro cambia de género o de slug también hay que invalidar los
+    # anteriores; se leen de la base donde se va a escribir, no de una réplica
+    instance._previous_scope = None
+    if instance.pk:
+        instance._previous_scope = (
+            Book.objects.using(using).filter(pk=instance.pk).values_list('genre_id', 'slug').first()
+        )
+
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_catalogue(sender, instance, **kwargs):
+    genre_ids, slugs = [instance.genre_id], [instance.slug]
+    previous = getattr(instance, '_previous_scope', None)
+    if previous:
+        genre_ids.append(previous[0])
+        slugs.append(previous[1])
+    catalogue_changed(genre_ids=genre_ids, book_slugs=slugs)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
@@ -0,0 +1,124 @@
+from collections import defaultdict
+
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+
+from .models import (
+    ArchivedLoan, ArchivedLoanItem, Book, DailyBookCirculation, DailyCirculation,
+    DailyGenreCirculation, Loan, LoanItem, LoanStatusCount,
+)
+
+REBUILD_BATCH_SIZE = 5000
+
+
+def increment(model, keys, rows):
+    """
+    Suma ``rows`` (diccionarios con los campos de ``keys`` y los contadores)
+    a las filas existentes, creando las que falten, con un único
+    INSERT ... ON CONFLICT DO UPDATE.
+
+    Las filas se ordenan por clave: dos transacciones que tocan las mismas
+    filas las bloquean en el mismo orden y no se interbloquean.
+    """
+    if not rows:
+        return
+    meta = model._meta
+    quote = connections[router.db_for_write(model)].ops.quote_name
+    fields = list(rows[0])
+    columns = [quote(meta.get_field(field).column) for field in fields]
+    counters = [column for field, column in zip(fields, columns) if field not in keys]
+    key_columns = [quote(meta.get_field(key).column) for key in keys]
+    rows = sorted(rows, key=lambda row: [row[key] for key in keys])
+
+    table = quote(meta.db_table)
+    placeholders = ', '.join([f"({', '.join(['%s'] * len(fields))})"] * len(rows))
+    updates = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in counters)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders} "
+        f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    )
+    params = [row[field] for row in rows for field in fields]
+    with connections[router.db_for_write(model)].cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_checkout(day, quantities, genre_ids):
+    """
+    Un préstamo nuevo del día ``day``: ``quantities`` es {book_id: cantidad}
+    y ``genre_ids`` {book_id: genre_id}.
+    """
+    by_genre = defaultdict(int)
+    for book_id, quantity in quantities.items():
+        by_genre[genre_ids[book_id]] += quantity
+    increment(DailyBookCirculation, ['day', 'book'], [
+        {'day': day, 'book': book_id, 'loans': 1, 'copies': quantity}
+        for book_id, quantity in quantities.items()
+    ])
+    increment(DailyGenreCirculation, ['day', 'genre'], [
+        {'day': day, 'genre': genre_id, 'loans': 1, 'copies': copies}
+        for genre_id, copies in by_genre.items()
+    ])
+    increment(DailyCirculation, ['day'], [
+        {'day': day, 'loans': 1, 'copies': sum(quantities.values())},
+    ])
+    increment(LoanStatusCount, ['status'], [{'status': 'active', 'count': 1}])
+
+
+def record_status_change(previous, new, count=1):
+    """``count`` préstamos pasaron de ``previous`` a ``new`` ('returned' no se cuenta)."""
+    if not count:
+        return
+    rows = [{'status': previous, 'count': -count}]
+    if new != 'returned':
+        rows.append({'status': new, 'count': count})
+    increment(LoanStatusCount, ['status'], rows)
+
+
+def rebuild():
+    """
+    Recalcula todos los resúmenes desde los préstamos activos y archivados
+    en una transacción: el panel ve los datos anteriores hasta el final.
+    """
+    with transaction.atomic():
+        for model in (DailyCirculation, DailyBookCirculation, DailyGenreCirculation, LoanStatusCount):
+            model.objects.all().delete()
+
+        # Préstamos y archivo son disjuntos: se suman uno tras otro
+        for items, loans in (
+            (LoanItem.objects.all(), Loan.objects.all()),
+            (ArchivedLoanItem.objects.all(), ArchivedLoan.objects.all()),
+        ):
+            # Los ítems archivados pueden ser de libros ya eliminados: cuentan
+            # en el total del día, pero no por libro ni por género
+            add_rows(DailyBookCirculation, ['day', 'book'], (
+                {'day': row['loan__created_at'], 'book': row['book_id'], 'loans': row['n'], 'copies': row['q']}
+                for row in items.filter(book_id__in=Book.objects.values('id')).values('loan__created_at', 'book_id').annotate(
+                    n=Count('loan_id', distinct=True), q=Sum('quantity'),
+                ).order_by().iterator(chunk_size=REBUILD_BATCH_SIZE)
+            ))
+            add_rows(DailyGenreCirculation, ['day', 'genre'], (
+                {'day': row['loan__created_at'], 'genre': row['book__genre_id'], 'loans': row['n'], 'copies': row['q']}
+                for row in items.values('loan__created_at', 'book__genre_id').annotate(
+                    n=Count('loan_id', distinct=True), q=Sum('quantity'),
+                ).order_by().iterator(chunk_size=REBUILD_BATCH_SIZE)
+            ))
+            copies = dict(items.values_list('loan__created_at').annotate(q=Sum('quantity')).order_by())
+            add_rows(DailyCirculation, ['day'], (
+                {'day': row['created_at'], 'loans': row['n'], 'copies': copies.get(row['created_at'], 0)}
+                for row in loans.values('created_at').annotate(n=Count('id')).order_by()
+            ))
+
+        add_rows(LoanStatusCount, ['status'], (
+            {'status': row['status'], 'count': row['n']}
+            for row in Loan.objects.exclude(status='returned').values('status').annotate(n=Count('id')).order_by()
+        ))
+
+
+def add_rows(model, keys, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            increment(model, keys, batch)
+            batch = []
+    increment(model, keys, batch)
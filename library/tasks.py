@@ -0,0 +1,153 @@
+import logging
+import traceback
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Loan, Task
+
+logger = logging.getLogger('library.tasks')
+
+# Tareas registradas: nombre -> función que recibe el payload como argumentos
+TASKS = {}
+
+
+class LeaseLost(Exception):
+    """La reserva de la tarea venció y otro worker la retomó."""
+
+
+def task(func):
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(name, delay=None, **payload):
+    """
+    Encola la tarea ``name`` con ``payload`` (serializable a JSON). Dentro
+    de una transacción solo se ejecutará si esta se confirma.
+    """
+    if name not in TASKS:
+        raise ValueError(f"Tarea desconocida: {name}")
+    run_after = timezone.now() + (delay or timedelta())
+    return Task.objects.create(name=name, payload=payload, run_after=run_after)
+
+
+def retry_delay(attempts):
+    """Espera exponencial tras el intento ``attempts``, con tope."""
+    base = getattr(settings, 'LIBRARY_TASK_RETRY_BACKOFF_SECONDS', 30)
+    limit = getattr(settings, 'LIBRARY_TASK_RETRY_BACKOFF_MAX_SECONDS', 3600)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), limit))
+
+
+def claim(batch_size):
+    """
+    Reserva hasta ``batch_size`` tareas vencidas con SELECT ... FOR UPDATE
+    SKIP LOCKED: varios workers reparten la cola sin esperarse. Cada tarea
+    queda 'running' hasta ``LIBRARY_TASK_TIMEOUT_SECONDS``; si el worker
+    muere antes, otro la retoma.
+    """
+    now = timezone.now()
+    timeout = timedelta(seconds=getattr(settings, 'LIBRARY_TASK_TIMEOUT_SECONDS', 300))
+    with transaction.atomic():
+        tasks = list(
+            Task.objects.filter(status__in=['pending', 'running'], run_after__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by('run_after', 'id')[:batch_size]
+        )
+        Task.objects.filter(id__in=[t.id for t in tasks]).update(
+            status='running', attempts=F('attempts') + 1, run_after=now + timeout,
+        )
+    for t in tasks:
+        t.status, t.attempts = 'running', t.attempts + 1
+    return tasks
+
+
+def run(t):
+    """
+    Ejecuta una tarea reservada. Sus escrituras y el borrado de la tarea
+    van en la misma transacción: se aplican una sola vez aunque la tarea
+    se reintente. Si falla, se reprograma con espera exponencial o, tras
+    ``LIBRARY_TASK_MAX_ATTEMPTS`` intentos, queda 'failed'. Devuelve si
+    terminó bien.
+    """
+    mine = Task.objects.filter(pk=t.pk, status='running', attempts=t.attempts)
+    try:
+        func = TASKS.get(t.name)
+        if func is None:
+            raise LookupError(f"Tarea desconocida: {t.name}")
+        with transaction.atomic():
+            func(**t.payload)
+            if not mine.delete()[0]:
+                raise LeaseLost()
+    except LeaseLost:
+        logger.warning("Tarea %s retomada por otro worker: se descarta este intento", t)
+        return False
+    except Exception:
+        error = traceback.format_exc()
+        if t.attempts >= getattr(settings, 'LIBRARY_TASK_MAX_ATTEMPTS', 5) or t.name not in TASKS:
+            mine.update(status='failed', last_error=error)
+            logger.error("Tarea %s fallida tras %d intentos", t, t.attempts, exc_info=True)
+        else:
+            mine.update(status='pending', run_after=timezone.now() + retry_delay(t.attempts), last_error=error)
+            logger.warning("Tarea %s falló (intento %d), se reintentará", t, t.attempts, exc_info=True)
+        return False
+    return True
+
+
+def run_pending(batch_size=None):
+    """Ejecuta tareas vencidas hasta vaciar la cola. Devuelve cuántas terminaron bien."""
+    batch_size = batch_size or getattr(settings, 'LIBRARY_TASK_BATCH_SIZE', 20)
+    done = 0
+    while tasks := claim(batch_size):
+        done += sum(run(t) for t in tasks)
+    return done
+
+
+# TAREAS
+
+@task
+def record_checkout(day, books):
+    """Estadísticas de un préstamo nuevo; ``books``: [[book_id, genre_id, cantidad], ...]."""
+    from . import stats
+
+    stats.record_checkout(
+        date.fromisoformat(day),
+        {book_id: quantity for book_id, _, quantity in books},
+        {book_id: genre_id for book_id, genre_id, _ in books},
+    )
+
+
+@task
+def record_status_change(previous, new, count=1):
+    from . import stats
+
+    stats.record_status_change(previous, new, count)
+
+
+@task
+def record_recommendations(book_ids):
+    from .recommendations import record_loan
+
+    record_loan(book_ids)
+
+
+@task
+def send_loan_email(loan_id, template):
+    """Correo al lector con el préstamo: ``template`` 'loan_created' o 'loan_returned'."""
+    loan = Loan.objects.select_related('reader').filter(pk=loan_id).first()
+    if loan is None:
+        # Archivado o borrado antes de avisar: ya no hay nada que contar
+        return
+    items = loan.items.select_related('book').only('quantity', 'book__title', 'book__author')
+    context = {'loan': loan, 'items': items}
+    send_mail(
+        render_to_string(f'emails/{template}_subject.txt', context).strip(),
+        render_to_string(f'emails/{template}.txt', context),
+        None,
+        [loan.reader.email],
+    )
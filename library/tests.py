@@ -1,3 +1,957 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import types
+import warnings
+from datetime import date, timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connections
+from django.db.models import F
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from .models import (
+    Genre, Book, Reader, Loan, LoanItem, ArchivedLoan, ArchivedLoanItem, BookRecommendation, BooksUnavailable,
+    DailyBookCirculation, DailyCirculation, DailyGenreCirculation, LoanStatusCount, Task,
+)
+from .pagination import EstimatedCountPaginator, KeysetPaginator
+from .routers import RoutingState, reset_replica_health, routing
+from .selection import LoanSelection
+from .tasks import TASKS, claim, enqueue, run, run_pending
+from .urls import build_urlpatterns
+from .views import BookSearchView
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LibraryTestCase(TestCase):
+    """Datos sembrados compartidos por las pruebas de la aplicación."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genres = [Genre.objects.create(name=f'Género {i}', slug=f'genero-{i}') for i in range(3)]
+        cls.books = [
+            Book.objects.create(
+                title=f'Libro {i}',
+                author=f'Autor {i % 7}',
+                genre=cls.genres[i % 3],
+                publication_year=1950 + i,
+                slug=f'libro-{i}',
+            )
+            for i in range(60)
+        ]
+        for n in range(30):
+            reader = Reader.objects.create(name=f'Lector {n}', email=f'lector{n}@ejemplo.com')
+            loan = Loan.objects.create(reader=reader, status='returned' if n % 3 == 0 else 'active')
+            LoanItem.objects.bulk_create([
+                LoanItem(loan=loan, book=book, quantity=1 + i)
+                for i, book in enumerate(cls.books[n % 10:n % 10 + 3])
+            ])
+        cls.loan = loan
+        cls.admin = User.objects.create_superuser('admin', 'admin@ejemplo.com', 'clave-segura')
+
+    def setUp(self):
+        cache.clear()
+        # El registro por petición se comprueba con assertLogs; fuera de
+        # ello no hace falta verlo en la consola.
+        logger = logging.getLogger('library.queries')
+        self.addCleanup(setattr, logger, 'propagate', logger.propagate)
+        logger.propagate = False
+
+
+class QueryBudgetTests(LibraryTestCase):
+    """Cada ruta de library/urls.py debe respetar LIBRARY_QUERY_BUDGETS."""
+
+    def request(self, method, url_name, *args, data=None, query='', **extra):
+        url = reverse(f'library:{url_name}', args=args) + query
+        # Primera petición para calentar la caché de navegación. Las que
+        # modifican datos se miden a la primera: repetirlas mediría otra
+        # rama (libro ya eliminado, préstamo ya devuelto...)
+        if method == 'get':
+            self.client.get(url, data or {}, **extra)
+        else:
+            self.client.get(reverse('library:selection_detail'))
+        with self.assertLogs('library.queries', 'INFO') as logs:
+            response = getattr(self.client, method)(url, data or {}, **extra)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], f'library:{url_name}')
+        self.assertEqual(record['queries'], int(response['X-DB-Query-Count']))
+        self.assertLessEqual(record['queries'], settings.LIBRARY_QUERY_BUDGETS[f'library:{url_name}'])
+        return response
+
+    def test_catalogue(self):
+        self.client.force_login(self.admin)
+        self.request('get', 'book_list')
+        cursor = KeysetPaginator(Book.objects.all(), 24, ('title', 'id')).page().next_cursor
+        self.request('get', 'book_list', query=f'?cursor={cursor}')
+        self.request('get', 'book_list_by_genre', 'genero-1')
+        self.request('get', 'book_search', query='?q=libro')
+        self.request('get', 'book_detail', 'libro-1')
+
+    def test_selection(self):
+        self.request('post', 'add_to_selection', 'libro-59')
+        self.request('get', 'selection_detail')
+        self.request('post', 'remove_from_selection', self.books[59].id)
+        self.request('post', 'clear_selection')
+
+    def test_selection_api(self):
+        book_id = self.books[59].id
+        self.request('post', 'api_selection_add', data={'book_id': book_id}, content_type='application/json')
+        self.request('get', 'api_selection')
+        self.request('post', 'api_selection_set', data={'book_id': book_id, 'quantity': 1},
+                     content_type='application/json')
+        self.request('post', 'api_selection_remove', data={'book_id': book_id}, content_type='application/json')
+        self.request('post', 'api_selection_clear', content_type='application/json')
+
+    def test_catalogue_api(self):
+        self.request('get', 'api_genre_list')
+        self.request('get', 'api_book_list', query='?genre=genero-1&available=true')
+        self.request('get', 'api_book_detail', 'libro-1')
+
+    def test_checkout(self):
+        self.client.post(reverse('library:add_to_selection', args=['libro-50']))
+        self.client.post(reverse('library:add_to_selection', args=['libro-51']))
+        self.request('get', 'create_loan')
+        url = reverse('library:create_loan')
+        with self.assertLogs('library.queries', 'INFO') as logs:
+            self.client.post(url, {'name': 'Ana', 'email': 'ana@ejemplo.com'})
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertLessEqual(record['queries'], settings.LIBRARY_QUERY_BUDGETS['library:create_loan'])
+
+    def test_loans(self):
+        self.client.force_login(self.admin)
+        self.request('get', 'loan_list')
+        self.request('get', 'loan_list', query='?status=active&date_from=2000-01-01')
+        self.request('get', 'loan_success', self.loan.id)
+        self.request('post', 'return_loan', self.loan.id)
+        self.request('get', 'stats')
+
+    def test_admin_forms(self):
+        self.client.force_login(self.admin)
+        self.request('get', 'create_genre')
+        self.request('get', 'create_book')
+        self.request('post', 'delete_book', 'libro-59')
+
+    def test_auth(self):
+        self.request('get', 'login')
+        self.request('get', 'register')
+        self.client.force_login(self.admin)
+        with self.assertLogs('library.queries', 'INFO') as logs:
+            self.client.post(reverse('library:logout'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertLessEqual(record['queries'], settings.LIBRARY_QUERY_BUDGETS['library:logout'])
+
+    def test_loan_list_does_not_grow_with_history(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('library:loan_list'))
+        before = int(self.client.get(reverse('library:loan_list'))['X-DB-Query-Count'])
+        for n in range(20):
+            loan = Loan.objects.create(reader=self.loan.reader)
+            LoanItem.objects.create(loan=loan, book=self.books[n])
+        after = int(self.client.get(reverse('library:loan_list'))['X-DB-Query-Count'])
+        self.assertEqual(before, after)
+
+
+class QueryBudgetMiddlewareTests(LibraryTestCase):
+
+    def test_headers(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('library:book_list'))
+        self.assertIn('X-DB-Query-Count', response)
+        self.assertTrue(response['Server-Timing'].startswith('db;dur='))
+
+    @override_settings(LIBRARY_QUERY_BUDGETS={'library:book_list': 0})
+    def test_warns_over_budget(self):
+        self.client.force_login(self.admin)
+        with self.assertLogs('library.queries', 'WARNING') as logs:
+            self.client.get(reverse('library:book_list'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['budget'], 0)
+        self.assertGreater(record['queries'], 0)
+
+
+class AdminChangelistTests(LibraryTestCase):
+    # Sesión, usuario, estimación del planificador, COUNT(*) (tablas
+    # pequeñas) y la página; Book suma los géneros del filtro lateral.
+    CHANGELISTS = [
+        ('book', '', 6),
+        ('book', '?genre__id__exact=1&available__exact=1', 6),
+        ('book', '?q=libro', 6),
+        ('reader', '?q=lector', 5),
+        ('loan', '', 5),
+        ('loan', '?status__exact=active&q=lector', 5),
+        ('loanitem', '', 5),
+        ('loanitem', '?q=3', 5),
+    ]
+
+    def test_query_count_per_changelist(self):
+        self.client.force_login(self.admin)
+        for model, query, expected in self.CHANGELISTS:
+            url = reverse(f'admin:library_{model}_changelist') + query
+            with self.subTest(url=url), self.assertNumQueries(expected):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_large_tables_skip_count(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:library_loanitem_changelist')
+        with patch.object(EstimatedCountPaginator, 'exact_limit', 0), self.assertNumQueries(4) as ctx:
+            self.client.get(url)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+    def test_edit_forms_do_not_list_every_row(self):
+        self.client.force_login(self.admin)
+        item = LoanItem.objects.first()
+        response = self.client.get(reverse('admin:library_loanitem_change', args=[item.pk]))
+        self.assertNotContains(response, f'<option value="{self.books[-1].pk}"')
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+
+
+@override_settings(CACHES=LOCMEM_CACHE, LIBRARY_READ_REPLICAS=['replica'])
+class ReplicaRouterTests(TransactionTestCase):
+    # Fuera de la transacción de TestCase: el router solo usa la réplica
+    # cuando no hay una transacción abierta en el primario
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        reset_replica_health()
+        self.addCleanup(reset_replica_health)
+        genre = Genre.objects.create(name='Poesía', slug='poesia')
+        self.book = Book.objects.create(
+            title='Poemas', author='Autora', genre=genre, publication_year=1950, slug='poemas',
+        )
+
+    def test_reads_go_to_replica_until_a_write(self):
+        with routing(RoutingState()) as state:
+            self.assertEqual(Book.objects.all().db, 'replica')
+            self.assertEqual(Loan.objects.all().db, 'replica')
+            self.assertEqual(User.objects.all().db, 'default')
+            self.book.save()
+            self.assertTrue(state.wrote)
+            self.assertEqual(Book.objects.all().db, 'default')
+
+    def test_lagging_or_unreachable_replica_is_skipped(self):
+        with routing(RoutingState()), self.assertLogs('library.routers', 'WARNING'):
+            with patch('library.routers.replica_lag', return_value=60):
+                self.assertEqual(Book.objects.all().db, 'default')
+            reset_replica_health()
+            with patch('library.routers.replica_lag', side_effect=OperationalError('sin conexión')):
+                self.assertEqual(Book.objects.all().db, 'default')
+            reset_replica_health()
+            self.assertEqual(Book.objects.all().db, 'replica')
+
+    def test_session_sticks_to_primary_after_a_write(self):
+        self.client.force_login(User.objects.create_user('lectora', password='clave-segura'))
+        url = reverse('library:book_search') + '?q=poemas'
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(url)
+        self.assertTrue(replica.captured_queries)
+
+        self.client.post(reverse('library:add_to_selection', args=['poemas']))
+        response = self.client.post(reverse('library:create_loan'), {'name': 'Ana', 'email': 'ana@ejemplo.com'})
+        self.assertIn('library_primary', response.cookies)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(url)
+        self.assertEqual(replica.captured_queries, [])
+
+    def test_cached_fragments_are_read_from_primary(self):
+        # Una réplica retrasada no debe quedar guardada en la caché bajo
+        # la versión nueva
+        self.client.force_login(User.objects.create_user('lectora', password='clave-segura'))
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('library:book_list'))
+            self.client.get(reverse('library:book_detail', args=['poemas']))
+            self.client.get(reverse('library:api_book_list'))
+        self.assertEqual(replica.captured_queries, [])
+        self.assertNotIn('library_primary', self.client.cookies)
+
+
+class LoanSelectionTests(LibraryTestCase):
+
+    def test_encoding_is_compact_and_reads_version_1(self):
+        selection = LoanSelection()
+        selection.add_book(self.books[0], 2)
+        selection.add_book(self.books[1])
+        self.assertEqual(selection.encode(), [2, [[self.books[0].id, 2], [self.books[1].id, 1]]])
+        self.assertEqual(len(LoanSelection.decode(selection.encode())), 3)
+
+        legacy = {str(self.books[0].id): {'book_id': self.books[0].id, 'title': 'x', 'quantity': 2}}
+        self.assertEqual(len(LoanSelection.decode(legacy)), 2)
+
+    def test_cookie_store_does_not_touch_the_session(self):
+        self.client.post(reverse('library:add_to_selection', args=['libro-1']))
+        self.assertIn('loan_selection', self.client.cookies)
+        self.assertNotIn('loan_selection', self.client.session.keys())
+        response = self.client.get(reverse('library:selection_detail'))
+        self.assertEqual(response.context['selection'].items[self.books[1].id].title, 'Libro 1')
+
+    @override_settings(LIBRARY_SELECTION_STORE='library.selection.CacheSelectionStore')
+    def test_cache_store(self):
+        Book.objects.filter(slug='libro-1').update(copies_total=2)
+        self.client.post(reverse('library:add_to_selection', args=['libro-1']))
+        self.client.post(reverse('library:add_to_selection', args=['libro-1']))
+        response = self.client.get(reverse('library:selection_detail'))
+        self.assertEqual(len(response.context['selection']), 2)
+
+
+class CopiesInventoryTests(LibraryTestCase):
+
+    def checkout(self, *quantities):
+        selection = LoanSelection()
+        for book, quantity in quantities:
+            selection.add_book(book, quantity)
+        return Loan.checkout(self.loan.reader, selection)
+
+    def test_checkout_reserves_copies(self):
+        book = self.books[40]
+        Book.objects.filter(pk=book.pk).update(copies_total=3)
+        loan = self.checkout((book, 2))
+        book.refresh_from_db()
+        self.assertEqual((book.copies_on_loan, book.copies_available), (2, 1))
+        self.assertTrue(book.available)
+
+        # Sin copias suficientes no se reserva nada de la selección
+        other = self.books[41]
+        loans = Loan.objects.count()
+        with self.assertRaises(BooksUnavailable) as ctx:
+            self.checkout((other, 1), (book, 2))
+        self.assertEqual([b.id for b in ctx.exception.books], [book.id])
+        self.assertEqual(Loan.objects.count(), loans)
+        other.refresh_from_db()
+        self.assertEqual(other.copies_on_loan, 0)
+
+        self.checkout((book, 1))
+        self.assertFalse(Book.objects.get(pk=book.pk).available)
+        self.assertTrue(loan.mark_returned())
+        book.refresh_from_db()
+        self.assertEqual((book.copies_on_loan, book.available), (1, True))
+
+    def test_save_keeps_reserved_copies(self):
+        Book.objects.filter(pk=self.books[40].pk).update(copies_total=3)
+        book = Book.objects.get(pk=self.books[40].pk)
+        self.checkout((self.books[40], 2))
+        # Instancia cargada antes del préstamo: no pisa el contador
+        book.title = 'Libro 40 (2.ª edición)'
+        book.save()
+        self.assertEqual(Book.objects.get(pk=book.pk).copies_on_loan, 2)
+
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:library_book_change', args=[book.pk]), {
+            'title': book.title, 'author': book.author, 'genre': book.genre_id,
+            'publication_year': book.publication_year, 'copies_total': 1, 'slug': book.slug,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('copies_total', response.context['adminform'].form.errors)
+
+    def test_checkout_drops_deleted_books_from_selection(self):
+        self.client.post(reverse('library:add_to_selection', args=['libro-45']))
+        self.client.post(reverse('library:add_to_selection', args=['libro-46']))
+        self.books[46].delete()
+        url = reverse('library:create_loan')
+        data = {'name': 'Ana', 'email': 'ana@ejemplo.com'}
+        self.assertRedirects(self.client.post(url, data), reverse('library:selection_detail'))
+        response = self.client.post(url, data)
+        loan = Loan.objects.latest('id')
+        self.assertRedirects(response, reverse('library:loan_success', args=[loan.id]))
+        self.assertEqual(list(loan.items.values_list('book_id', flat=True)), [self.books[45].id])
+
+    def test_save_keeps_reader_counters(self):
+        reader = Reader.objects.get(pk=self.loan.reader_id)
+        selection = LoanSelection()
+        selection.add_book(self.books[47], 1)
+        Loan.checkout(reader, selection)
+        # Instancia cargada antes del préstamo: no pisa los contadores
+        reader.name = 'Lectora 29'
+        reader.save()
+        reader.refresh_from_db()
+        self.assertEqual((reader.name, reader.outstanding_loans(), reader.last_loan_date), ('Lectora 29', 1, date.today()))
+
+    def test_empty_selection_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Loan.checkout(self.loan.reader, LoanSelection())
+
+    def test_selection_limited_to_free_copies(self):
+        url = reverse('library:add_to_selection', args=['libro-42'])
+        self.client.post(url)
+        self.client.post(url)
+        response = self.client.get(reverse('library:selection_detail'))
+        self.assertEqual(len(response.context['selection']), 1)
+
+
+class SelectionApiTests(LibraryTestCase):
+
+    def post(self, url_name, data=None):
+        return self.client.post(reverse(f'library:{url_name}'), data or {}, content_type='application/json')
+
+    def test_add_set_remove(self):
+        Book.objects.filter(pk=self.books[1].pk).update(copies_total=2)
+        response = self.post('api_selection_add', {'items': [
+            {'book_id': self.books[1].id, 'quantity': 2},
+            {'book_id': self.books[2].id},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(response.json()['items'][0]['title'], 'Libro 1')
+
+        response = self.post('api_selection_set', {'book_id': self.books[1].id, 'quantity': 5})
+        self.assertEqual(response.status_code, 409)
+        data = self.post('api_selection_set', {'book_id': self.books[1].id, 'quantity': 1}).json()
+        self.assertEqual(data['count'], 2)
+        data = self.post('api_selection_set', {'book_id': self.books[2].id, 'quantity': 0}).json()
+        self.assertEqual([item['book_id'] for item in data['items']], [self.books[1].id])
+        data = self.post('api_selection_remove', {'book_id': self.books[1].id}).json()
+        self.assertEqual(data, {'items': [], 'count': 0})
+
+        # La API y las vistas HTML comparten el mismo almacén
+        self.post('api_selection_add', {'book_id': self.books[3].id})
+        response = self.client.get(reverse('library:selection_detail'))
+        self.assertEqual(len(response.context['selection']), 1)
+
+    def test_errors(self):
+        Book.objects.filter(pk=self.books[4].pk).update(copies_on_loan=F('copies_total'))
+        self.assertEqual(self.post('api_selection_add', {'book_id': self.books[4].id}).status_code, 409)
+        self.assertEqual(self.post('api_selection_add', {'book_id': 0}).status_code, 404)
+        self.assertEqual(self.post('api_selection_add', {'quantity': 1}).status_code, 400)
+        self.assertEqual(self.post('api_selection_add', {'book_id': self.books[1].id, 'quantity': 0}).status_code, 400)
+        self.assertEqual(self.post('api_selection_add', {'items': [
+            {'book_id': self.books[1].id}, {'book_id': self.books[2].id, 'quantity': -1},
+        ]}).status_code, 400)
+        self.assertEqual(self.post('api_selection_set', {'book_id': self.books[1].id}).status_code, 404)
+        response = self.client.post(reverse('library:api_selection_add'), 'no es json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+    def test_detail_form_works_without_javascript(self):
+        # El formulario está en el fragmento cacheado y el token fuera de él
+        client = Client(enforce_csrf_checks=True)
+        url = reverse('library:book_detail', args=['libro-5'])
+        client.get(url)
+        response = client.get(url)
+        self.assertContains(response, 'action="%s"' % reverse('library:add_to_selection', args=['libro-5']))
+        token = response.context['csrf_token']
+        self.assertContains(response, f'value="{token}" form="add-to-cart-form"')
+        response = client.post(reverse('library:add_to_selection', args=['libro-5']), {'csrfmiddlewaretoken': token})
+        self.assertRedirects(response, reverse('library:selection_detail'))
+        self.assertEqual(len(client.get(reverse('library:selection_detail')).context['selection']), 1)
+
+
+class CatalogueApiTests(LibraryTestCase):
+
+    def test_list_filters_and_pages(self):
+        url = reverse('library:api_book_list')
+        data = self.client.get(url, {'genre': 'genero-1'}).json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual({book['genre'] for book in data['results']}, {'genero-1'})
+        self.assertIsNone(data['next'])
+
+        first = self.client.get(url).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 60)
+        self.assertEqual(self.client.get(second['previous']).json(), first)
+
+        self.assertEqual(self.client.get(url, {'genre': 'no-existe'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'available': 'quizá'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'x'}).status_code, 400)
+
+    def test_conditional_get_and_cache(self):
+        url = reverse('library:api_book_detail', args=['libro-1'])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['title'], 'Libro 1')
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url).json(), response.json())
+
+        # Un préstamo cambia la disponibilidad con update(): también invalida
+        selection = LoanSelection()
+        selection.add_book(self.books[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.checkout(self.loan.reader, selection)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertFalse(changed.json()['available'])
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+
+class BookSearchTests(LibraryTestCase):
+
+    def search_ids(self, client, q, cursor=None):
+        query = {'q': q, **({'cursor': cursor} if cursor else {})}
+        page = client.get(reverse('library:book_search'), query).context['page_obj']
+        return [book.id for book in page.object_list], page.next_cursor if page.has_next() else None
+
+    def test_ranks_title_above_author_and_pages_by_cursor(self):
+        genre = self.genres[0]
+        by_author = [
+            Book.objects.create(title=f'Novela {n}', author='Miguel de Cervantes', genre=genre,
+                                publication_year=1605, slug=f'novela-{n}')
+            for n in range(4)
+        ]
+        by_title = Book.objects.create(title='Cervantes y su tiempo', author='Ana Ruiz', genre=genre,
+                                       publication_year=1990, slug='cervantes-y-su-tiempo')
+        self.client.force_login(self.admin)
+
+        with patch.object(BookSearchView, 'paginate_by', 2):
+            ids, cursor = self.search_ids(self.client, 'cervantes')
+            pages = [ids]
+            # Un libro nuevo que iría primero no desplaza las páginas siguientes
+            Book.objects.create(title='Cervantes', author='Cervantes', genre=genre,
+                                publication_year=2000, slug='cervantes')
+            while cursor:
+                ids, cursor = self.search_ids(self.client, 'cervantes', cursor)
+                pages.append(ids)
+
+        # El título pesa más que el autor; a igual relevancia desempata el id
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [by_title.id] + [book.id for book in by_author])
+
+
+class FragmentCacheTests(LibraryTestCase):
+
+    def queries(self, url):
+        return int(self.client.get(url)['X-DB-Query-Count'])
+
+    def test_book_grid_invalidated_per_genre(self):
+        self.client.force_login(self.admin)
+        genre_1 = reverse('library:book_list_by_genre', args=['genero-1'])
+        genre_2 = reverse('library:book_list_by_genre', args=['genero-2'])
+        cold = self.queries(genre_1)
+        self.queries(genre_2)
+        warm = self.queries(genre_1)
+        self.assertLess(warm, cold)
+
+        book = self.books[2]  # genero-2
+        book.title = 'Libro renombrado'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(self.queries(genre_1), warm)
+        response = self.client.get(genre_2)
+        self.assertGreater(int(response['X-DB-Query-Count']), warm)
+        self.assertContains(response, 'Libro renombrado')
+
+    def test_per_user_bits_are_not_cached(self):
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse('library:book_list')), 'delete-book')
+        # Con la cuadrícula ya en caché, los demás no reciben los controles
+        self.client.force_login(User.objects.create_user('lectora', password='clave-segura'))
+        response = self.client.get(reverse('library:book_list'))
+        self.assertContains(response, 'data-slug="libro-0"')
+        self.assertNotContains(response, 'delete-book')
+        self.assertNotContains(response, 'Eliminar')
+
+    def test_book_detail_served_from_cache(self):
+        Book.objects.filter(pk=self.books[1].pk).update(copies_on_loan=F('copies_total'))
+        url = reverse('library:book_detail', args=['libro-1'])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'no está disponible')
+
+        # Devolver un préstamo libera el libro con update(): invalida su detalle
+        loan = Loan.objects.filter(status='active', items__book=self.books[1]).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            loan.mark_returned()
+        self.assertContains(self.client.get(url), 'disponible para préstamo')
+
+
+class ImportBooksTests(LibraryTestCase):
+
+    def run_import(self, name, content, *args):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        errors = os.path.join(directory.name, 'errores.csv')
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(content)
+        call_command('import_books', path, '--batch-size', '2', '--errors', errors, *args, stdout=io.StringIO())
+        with open(errors, encoding='utf-8') as fh:
+            return list(csv.reader(fh))[1:]
+
+    def test_csv_with_duplicate_slugs_and_errors(self):
+        errors = self.run_import('libros.csv', (
+            'title,author,genre,publication_year,copies\n'
+            'Libro 1,Autora,genero-1,1990,\n'
+            'Libro 1,Autora,Género 2,1991,4\n'
+            'Sin año,Autora,genero-1,antiguo,\n'
+            'Otro,Autora,Poesía,2000,1\n'
+        ))
+        self.assertEqual([row[0] for row in errors], ['4', '5'])
+        imported = Book.objects.filter(author='Autora').order_by('id')
+        self.assertEqual([book.slug for book in imported], ['libro-1-2', 'libro-1-3'])
+        self.assertEqual(imported[1].genre, self.genres[2])
+        self.assertEqual([book.copies_total for book in imported], [1, 4])
+
+    def test_jsonl_can_create_genres(self):
+        errors = self.run_import('libros.jsonl', (
+            '{"title": "Poemas", "author": "Autora", "genre": "Poesía", "publication_year": 1950}\n'
+            'no es json\n'
+        ), '--create-genres')
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(Book.objects.get(title='Poemas').genre.slug, 'poesia')
+
+
+class SweepOverdueLoansTests(LibraryTestCase):
+
+    def sweep(self, *args):
+        out = io.StringIO()
+        call_command('sweep_overdue_loans', *args, stdout=out)
+        return out.getvalue()
+
+    def test_marks_only_expired_loans_in_batches(self):
+        now = timezone.now()
+        period = timedelta(days=settings.LIBRARY_LOAN_PERIOD_DAYS)
+        active = list(Loan.objects.filter(status='active').order_by('id').values_list('id', flat=True))
+        expired, recent = active[:5], active[5:7]
+        Loan.objects.filter(id__in=expired).update(created_at=now - period - timedelta(days=2))
+        Loan.objects.filter(id__in=recent).update(created_at=now - period + timedelta(days=1))
+        Loan.objects.filter(status='returned').update(created_at=now - period * 3)
+
+        # Se interrumpe tras un lote y la siguiente ejecución sigue donde quedó
+        self.assertIn('2 préstamos marcados como vencidos en 1 lotes', self.sweep('--batch-size', '2', '--max-batches', '1'))
+        self.assertIn('3 préstamos marcados como vencidos en 2 lotes', self.sweep('--batch-size', '2'))
+        self.assertEqual(set(Loan.objects.filter(status='late').values_list('id', flat=True)), set(expired))
+        self.assertEqual(Loan.objects.filter(status='returned').count(), 10)
+
+        # Otra ejecución no cambia nada
+        self.assertIn('0 préstamos marcados como vencidos en 0 lotes', self.sweep('--batch-size', '2'))
+        self.assertEqual(Loan.objects.filter(status='late').count(), 5)
+        self.assertEqual(LoanStatusCount.objects.get(status='late').count, 5)
+
+
+class ArchiveLoansTests(LibraryTestCase):
+
+    def test_command_moves_old_returned_loans(self):
+        returned = Loan.objects.filter(status='returned')
+        returned.update(created_at=date(2000, 1, 1))
+        expected = {loan.id: loan.total_books() for loan in returned}
+        active = Loan.objects.exclude(status='returned').count()
+
+        call_command('archive_loans', '--batch-size', '3', stdout=io.StringIO())
+        self.assertFalse(Loan.objects.filter(status='returned').exists())
+        self.assertEqual(Loan.objects.count(), active)
+        archived = {loan.id: sum(item.quantity for item in loan.items.all()) for loan in ArchivedLoan.objects.all()}
+        self.assertEqual(archived, expected)
+        self.assertFalse(LoanItem.objects.filter(loan_id__in=expected).exists())
+
+        # La fecha del último préstamo sale también del archivo
+        reader = ArchivedLoan.objects.first().reader
+        call_command('recompute_reader_stats', stdout=io.StringIO())
+        reader.refresh_from_db()
+        self.assertIsNotNone(reader.last_loan_date)
+
+    def test_delete_book_archives_its_history(self):
+        book = self.books[55]
+        loan = Loan.objects.create(reader=self.loan.reader, status='returned')
+        LoanItem.objects.create(loan=loan, book=book, quantity=2)
+        self.client.force_login(self.admin)
+        self.client.get(reverse('library:selection_detail'))
+
+        # Devuelto hace poco: sigue en las tablas activas y el libro se queda
+        self.client.post(reverse('library:delete_book', args=[book.slug]))
+        self.assertTrue(Book.objects.filter(pk=book.pk).exists())
+        self.assertTrue(Loan.objects.filter(pk=loan.pk).exists())
+
+        Loan.objects.filter(pk=loan.pk).update(created_at=date(2000, 1, 1))
+        response = self.client.post(reverse('library:delete_book', args=[book.slug]))
+        self.assertLessEqual(int(response['X-DB-Query-Count']), settings.LIBRARY_QUERY_BUDGETS['library:delete_book'])
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+        self.assertFalse(Loan.objects.filter(pk=loan.pk).exists())
+        item = ArchivedLoanItem.objects.get(loan=loan.pk)
+        self.assertEqual((item.book_id, item.book_title, item.quantity), (book.id, 'Libro 55', 2))
+
+        # Con préstamos sin devolver no se borra ni se archiva nada
+        Loan.objects.update(created_at=date(2000, 1, 1))
+        self.client.post(reverse('library:delete_book', args=['libro-1']))
+        self.assertTrue(Book.objects.filter(slug='libro-1').exists())
+        self.assertFalse(ArchivedLoanItem.objects.filter(book_id=self.books[1].id).exists())
+
+    @override_settings(LIBRARY_DELETE_BOOK_ARCHIVE_BATCH=2)
+    def test_delete_book_archives_one_batch_per_request(self):
+        book = self.books[55]
+        for _ in range(3):
+            loan = Loan.objects.create(reader=self.loan.reader, status='returned')
+            LoanItem.objects.create(loan=loan, book=book)
+        Loan.objects.filter(items__book=book).update(created_at=date(2000, 1, 1))
+        self.client.force_login(self.admin)
+        url = reverse('library:delete_book', args=[book.slug])
+
+        self.client.post(url)
+        self.assertEqual(ArchivedLoanItem.objects.filter(book_id=book.id).count(), 2)
+        self.assertTrue(Book.objects.filter(pk=book.pk).exists())
+        self.client.post(url)
+        self.assertEqual(ArchivedLoanItem.objects.filter(book_id=book.id).count(), 3)
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+
+
+class AdviseIndexesTests(LibraryTestCase):
+
+    def advise(self, *args):
+        out = io.StringIO()
+        call_command('advise_indexes', *args, stdout=out)
+        return out.getvalue()
+
+    def test_probes_the_queries_of_the_views(self):
+        # Con --rows 1 cualquier Seq Scan se señala y se proponen índices
+        report = json.loads(self.advise('--json', '--analyze', '--rows', '1'))
+        probes = {entry['probe']: entry for entry in report}
+        self.assertIn('DeleteBookView (préstamos a archivar)', probes)
+        self.assertIn('DeleteBookView (ítems del libro)', probes)
+        self.assertIn('ReturnLoanView (libros del préstamo)', probes)
+        self.assertEqual(probes['DeleteBookView (ítems del libro)']['table'], LoanItem._meta.db_table)
+        for entry in report:
+            self.assertIsInstance(entry['issues'], list)
+        self.assertIn(f'{len(report)} consultas analizadas', self.advise('--rows', '1'))
+
+    def test_skips_loan_probes_without_loans(self):
+        LoanItem.objects.all().delete()
+        Loan.objects.all().delete()
+        probes = [entry['probe'] for entry in json.loads(self.advise('--json'))]
+        self.assertNotIn('ReturnLoanView (libros del préstamo)', probes)
+        self.assertIn('BookListView', probes)
+
+    def test_requires_seeded_data(self):
+        LoanItem.objects.all().delete()
+        Book.objects.all().delete()
+        with self.assertRaises(CommandError):
+            self.advise()
+
+
+class CirculationStatsTests(LibraryTestCase):
+
+    def snapshot(self):
+        return (
+            sorted(DailyBookCirculation.objects.values_list('day', 'book_id', 'loans', 'copies')),
+            sorted(DailyGenreCirculation.objects.values_list('day', 'genre_id', 'loans', 'copies')),
+            sorted(DailyCirculation.objects.values_list('day', 'loans', 'copies')),
+            dict(LoanStatusCount.objects.exclude(count=0).values_list('status', 'count')),
+        )
+
+    def test_incremental_updates_match_rebuild(self):
+        call_command('rebuild_circulation_stats', stdout=io.StringIO())
+        selection = LoanSelection()
+        selection.add_book(self.books[40], 1)
+        selection.add_book(self.books[43], 1)
+        loan = Loan.checkout(self.loan.reader, selection)
+        Loan.objects.filter(status='active').first().mark_returned()
+        Loan.objects.filter(pk=loan.pk).update(created_at=date(2000, 1, 1))
+        call_command('sweep_overdue_loans', stdout=io.StringIO())
+        Loan.objects.filter(pk=loan.pk).update(created_at=date.today())
+        loan.mark_returned()
+        run_pending()
+
+        incremental = self.snapshot()
+        self.assertEqual(incremental[3], {'active': 19})
+        call_command('rebuild_circulation_stats', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_stats_view(self):
+        call_command('rebuild_circulation_stats', stdout=io.StringIO())
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('library:stats'), {'days': 7})
+        self.assertEqual(response.context['active_count'], 20)
+        self.assertEqual(response.context['top_books'][0]['book'], self.books[2])
+        self.assertContains(response, 'Género 1')
+
+        self.client.force_login(User.objects.create_user('lectora', password='clave-segura'))
+        self.assertRedirects(self.client.get(reverse('library:stats')), reverse('library:book_list'))
+
+
+class RecommendationTests(LibraryTestCase):
+
+    def recommended(self, book):
+        return dict(BookRecommendation.objects.filter(book=book).values_list('recommended_id', 'loans'))
+
+    def test_rebuild_and_incremental_updates(self):
+        call_command('rebuild_recommendations', '--chunk-size', '7', stdout=io.StringIO())
+        books = self.books
+        self.assertEqual(self.recommended(books[2]), {books[0].id: 3, books[1].id: 6, books[3].id: 6, books[4].id: 3})
+
+        Book.objects.filter(pk=books[2].pk).update(copies_total=2)
+        selection = LoanSelection()
+        selection.add_book(books[2], 1)
+        selection.add_book(books[40], 1)
+        Loan.checkout(self.loan.reader, selection)
+        run_pending()
+        self.assertEqual(self.recommended(books[40]), {books[2].id: 1})
+        incremental = sorted(BookRecommendation.objects.values_list('book_id', 'recommended_id', 'loans'))
+        call_command('rebuild_recommendations', stdout=io.StringIO())
+        self.assertEqual(sorted(BookRecommendation.objects.values_list('book_id', 'recommended_id', 'loans')), incremental)
+
+        # Con 1 recomendación visible se guardan 3 por libro
+        with override_settings(LIBRARY_RECOMMENDATIONS=1):
+            selection.remove_book(books[40].id)
+            selection.add_book(books[50], 1)
+            Loan.checkout(self.loan.reader, selection)
+            run_pending()
+            kept = self.recommended(books[2])
+            self.assertEqual(kept, {books[1].id: 6, books[3].id: 6, books[4].id: 3})
+            # El recorte desempata igual que la reconstrucción
+            call_command('rebuild_recommendations', stdout=io.StringIO())
+            self.assertEqual(self.recommended(books[2]), kept)
+        self.assertEqual(self.recommended(books[50]), {books[2].id: 1})
+
+    def test_book_detail_lists_recommendations(self):
+        call_command('rebuild_recommendations', stdout=io.StringIO())
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('library:book_detail', args=['libro-2']))
+        self.assertContains(response, 'Otros lectores también se llevaron')
+        self.assertContains(response, reverse('library:book_detail', args=['libro-3']))
+        self.assertNotContains(response, reverse('library:book_detail', args=['libro-9']))
+
+        # El worker actualiza las recomendaciones después del COMMIT del
+        # préstamo: invalida él mismo el detalle cacheado
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('record_recommendations', book_ids=[self.books[2].id, self.books[9].id])
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        response = self.client.get(reverse('library:book_detail', args=['libro-2']))
+        self.assertContains(response, reverse('library:book_detail', args=['libro-9']))
+
+
+class TaskQueueTests(LibraryTestCase):
+
+    def test_checkout_side_effects_run_in_worker(self):
+        selection = LoanSelection()
+        selection.add_book(self.books[40], 1)
+        selection.add_book(self.books[41], 2)
+        Book.objects.filter(pk=self.books[41].pk).update(copies_total=2)
+        loan = Loan.checkout(self.loan.reader, selection)
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)),
+            ['record_checkout', 'record_recommendations', 'send_loan_email'],
+        )
+        self.assertEqual(mail.outbox, [])
+
+        out = io.StringIO()
+        call_command('run_tasks', '--once', '--concurrency', '1', stdout=out)
+        self.assertIn('3 tareas completadas', out.getvalue())
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(DailyCirculation.objects.get(day=loan.created_at).copies, 3)
+        [message] = mail.outbox
+        self.assertEqual(message.to, [self.loan.reader.email])
+        self.assertEqual(message.subject, f'Préstamo #{loan.pk} registrado')
+        self.assertIn('Libro 41 (Autor 6) x2', message.body)
+
+        loan.mark_returned()
+        run_pending()
+        self.assertEqual(mail.outbox[-1].subject, f'Préstamo #{loan.pk} devuelto')
+
+    @override_settings(LIBRARY_TASK_MAX_ATTEMPTS=2, LIBRARY_TASK_RETRY_BACKOFF_SECONDS=60)
+    def test_failures_are_retried_with_backoff(self):
+        calls = []
+
+        def flaky(**payload):
+            calls.append(payload)
+            raise ValueError('sin conexión')
+
+        with patch.dict(TASKS, flaky=flaky), self.assertLogs('library.tasks', 'WARNING'):
+            task = enqueue('flaky', n=1)
+            self.assertFalse(run_pending())
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts), ('pending', 1))
+            self.assertIn('sin conexión', task.last_error)
+            self.assertGreater(task.run_after, timezone.now() + timedelta(seconds=50))
+            # Aún no toca
+            self.assertEqual(claim(10), [])
+
+            Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+            run_pending()
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts), ('failed', 2))
+        self.assertEqual(calls, [{'n': 1}, {'n': 1}])
+
+    def test_expired_lease_is_taken_over(self):
+        task = enqueue('record_status_change', previous='active', new='late')
+        [first] = claim(10)
+        # El worker dejó de responder: su reserva vence y otro la retoma
+        Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+        [second] = claim(10)
+        self.assertEqual(second.attempts, 2)
+        with self.assertLogs('library.tasks', 'WARNING'):
+            self.assertFalse(run(first))
+        self.assertTrue(run(second))
+        self.assertEqual(dict(LoanStatusCount.objects.values_list('status', 'count')), {'active': -1, 'late': 1})
+
+
+class ExportCsvTests(LibraryTestCase):
+
+    def test_superuser_streams_csv(self):
+        url = reverse('library:export_csv', args=['loans'])
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['prestamo_id', 'fecha', 'estado'])
+        self.assertEqual(len(rows) - 1, LoanItem.objects.count())
+        self.assertEqual(rows[1][4], 'Lector 0')
+        self.assertEqual(self.client.get(reverse('library:export_csv', args=['nada'])).status_code, 404)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_csv', 'books', '--chunk-size', '7', stdout=out)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 61)
+        self.assertEqual(rows[1][4], 'Género 0')
+
+
+ASYNC_URLCONF = types.ModuleType('library_async_urls')
+ASYNC_URLCONF.urlpatterns = [path('', include((build_urlpatterns(asynchronous=True), 'library')))]
+
+
+@override_settings(ROOT_URLCONF=ASYNC_URLCONF)
+class AsyncViewsTests(LibraryTestCase):
+
+    async def test_book_list(self):
+        url = reverse('library:book_list_by_genre', args=['genero-1'])
+        self.assertEqual((await self.async_client.get(url)).status_code, 302)
+
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Libro 1')
+        self.assertContains(response, 'delete-book')
+        # Las consultas del ORM async también se cuentan
+        self.assertGreater(int(response['X-DB-Query-Count']), 0)
+
+    async def test_csv_export_streams_asynchronously(self):
+        await self.async_client.aforce_login(self.admin)
+        with patch('library.exports.LINES_PER_BLOCK', 10):
+            response = await self.async_client.get(reverse('library:export_csv', args=['loans']))
+            # Con un iterador síncrono Django avisaría y lo leería entero antes de enviar
+            self.assertTrue(response.is_async)
+            chunks = []
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                async for chunk in response.streaming_content:
+                    chunks.append(chunk)
+        count = await LoanItem.objects.acount()
+        self.assertEqual(len(chunks), 1 + -(-count // 10))
+        rows = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual(rows[0][:3], ['prestamo_id', 'fecha', 'estado'])
+        self.assertEqual(len(rows) - 1, count)
+
+    async def test_book_detail_and_selection(self):
+        response = await self.async_client.get(reverse('library:book_detail', args=['libro-2']))
+        self.assertContains(response, 'Libro 2')
+        response = await self.async_client.get(reverse('library:book_detail', args=['no-existe']))
+        self.assertEqual(response.status_code, 404)
+
+        await self.async_client.post(
+            reverse('library:api_selection_add'), {'book_id': self.books[3].id}, content_type='application/json',
+        )
+        response = await self.async_client.get(reverse('library:selection_detail'))
+        self.assertEqual(response.context['selection'].items[self.books[3].id].title, 'Libro 3')
@@ -1,25 +1,54 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from django.contrib.auth.views import LogoutView
 
 app_name = 'library'
 
-urlpatterns = [
-    path('', views.BookListView.as_view(), name='book_list'),
-    path('book/<slug:slug>/', views.BookDetailView.as_view(), name='book_detail'),
-    path('genre/<slug:genre_slug>/', views.BookListView.as_view(), name='book_list_by_genre'),
-    path('selection/', views.SelectionDetailView.as_view(), name='selection_detail'),
-    path('selection/add/<slug:book_slug>/', views.AddToSelectionView.as_view(), name='add_to_selection'),
-    path('selection/remove/<int:book_id>/', views.RemoveFromSelectionView.as_view(), name='remove_from_selection'),
-    path('selection/clear/', views.ClearSelectionView.as_view(), name='clear_selection'),
-    path('create-genre/', views.CreateGenreView.as_view(), name='create_genre'),
-    path('create-book/', views.CreateBookView.as_view(), name='create_book'),
-    path('create-loan/', views.CreateLoanView.as_view(), name='create_loan'),
-    path('loans/', views.LoanListView.as_view(), name='loan_list'),
-    path('loan/success/<int:loan_id>/', views.LoanSuccessView.as_view(), name='loan_success'),
-    path('loan/return/<int:loan_id>/', views.ReturnLoanView.as_view(), name='return_loan'),
-    path('delete-book/<slug:slug>/', views.DeleteBookView.as_view(), name='delete_book'),
-    path('login/', views.CustomLoginView.as_view(), name='login'),
-    path('logout/', LogoutView.as_view(next_page='library:book_list'), name='logout'),
-    path('register/', views.RegisterView.as_view(), name='register'),
-]
\ No newline at end of file
+
+def build_urlpatterns(asynchronous=False):
+    """
+    Rutas de la aplicación. Con ``asynchronous`` el catálogo, el detalle y
+    la selección se sirven con las vistas async (para despliegues ASGI).
+    """
+    if asynchronous:
+        book_list, book_detail, selection_detail = (
+            views.AsyncBookListView, views.AsyncBookDetailView, views.AsyncSelectionDetailView,
+        )
+    else:
+        book_list, book_detail, selection_detail = (
+            views.BookListView, views.BookDetailView, views.SelectionDetailView,
+        )
+    return [
+        path('', book_list.as_view(), name='book_list'),
+        path('search/', views.BookSearchView.as_view(), name='book_search'),
+        path('book/<slug:slug>/', book_detail.as_view(), name='book_detail'),
+        path('genre/<slug:genre_slug>/', book_list.as_view(), name='book_list_by_genre'),
+        path('selection/', selection_detail.as_view(), name='selection_detail'),
+        path('selection/add/<slug:book_slug>/', views.AddToSelectionView.as_view(), name='add_to_selection'),
+        path('selection/remove/<int:book_id>/', views.RemoveFromSelectionView.as_view(), name='remove_from_selection'),
+        path('selection/clear/', views.ClearSelectionView.as_view(), name='clear_selection'),
+        path('api/selection/', views.SelectionStateApiView.as_view(), name='api_selection'),
+        path('api/selection/add/', views.SelectionAddApiView.as_view(), name='api_selection_add'),
+        path('api/selection/set/', views.SelectionSetQuantityApiView.as_view(), name='api_selection_set'),
+        path('api/selection/remove/', views.SelectionRemoveApiView.as_view(), name='api_selection_remove'),
+        path('api/selection/clear/', views.SelectionClearApiView.as_view(), name='api_selection_clear'),
+        path('api/genres/', views.GenreListApiView.as_view(), name='api_genre_list'),
+        path('api/books/', views.BookListApiView.as_view(), name='api_book_list'),
+        path('api/books/<slug:slug>/', views.BookDetailApiView.as_view(), name='api_book_detail'),
+        path('create-genre/', views.CreateGenreView.as_view(), name='create_genre'),
+        path('create-book/', views.CreateBookView.as_view(), name='create_book'),
+        path('create-loan/', views.CreateLoanView.as_view(), name='create_loan'),
+        path('loans/', views.LoanListView.as_view(), name='loan_list'),
+        path('loan/success/<int:loan_id>/', views.LoanSuccessView.as_view(), name='loan_success'),
+        path('loan/return/<int:loan_id>/', views.ReturnLoanView.as_view(), name='return_loan'),
+        path('delete-book/<slug:slug>/', views.DeleteBookView.as_view(), name='delete_book'),
+        path('export/<slug:dataset>.csv', views.ExportCsvView.as_view(), name='export_csv'),
+        path('stats/', views.StatsView.as_view(), name='stats'),
+        path('login/', views.CustomLoginView.as_view(), name='login'),
+        path('logout/', LogoutView.as_view(next_page='library:book_list'), name='logout'),
+        path('register/', views.RegisterView.as_view(), name='register'),
+    ]
+
+
+urlpatterns = build_urlpatterns(getattr(settings, 'LIBRARY_ASYNC_VIEWS', False))
\ No newline at end of file
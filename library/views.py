@@ -1,12 +1,40 @@
-from django.shortcuts import get_object_or_404, redirect
+import hashlib
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404, redirect, render
 from django.views.generic import ListView, DetailView, TemplateView, View, CreateView
-from django.db.models import QuerySet
+from django.views.generic.base import ContextMixin
+from django.db import transaction
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import QuerySet, Prefetch, ProtectedError, Sum, OuterRef, Subquery, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, TruncMonth
 from typing import Any
-from .models import Book, Genre, Reader, Loan, LoanItem
-from .selection import LoanSelection
-from .forms import GenreForm, BookForm, ReaderForm, CustomUserCreationForm
-from django.http import HttpResponseRedirect
-from django.urls import reverse_lazy
+from .models import (
+    Book, Genre, Reader, Loan, LoanItem, BooksUnavailable,
+    DailyBookCirculation, DailyCirculation, DailyGenreCirculation, LoanStatusCount,
+)
+from .recommendations import arecommendations_for, recommendations_for
+from .routers import primary_reads
+from .selection import get_selection_store
+from .pagination import KeysetPaginator, InvalidCursor
+from .exports import EXPORTS, astream_csv, stream_csv
+from .cache import (
+    API_TIMEOUT, FRAGMENT_TIMEOUT, afragment_key, aget_nav_genres, book_scope, fragment_key,
+    genre_scope, get_genre_id, get_last_modified, get_nav_genres, get_version,
+)
+from .forms import GenreForm, BookForm, ReaderForm, LoanFilterForm, CustomUserCreationForm
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
+from django.utils.safestring import mark_safe
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.contrib import messages
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -15,28 +43,12 @@ from django.contrib.auth import login
 # Create your views here.
 
 
-SESSION_KEY = "loan_selection"
-
-
 def get_selection(request):
-    raw = request.session.get(SESSION_KEY)
-    if raw:
-        return LoanSelection.from_dict(raw)
-    return LoanSelection()
+    return get_selection_store(request).load()
 
 
 def save_selection(request, selection):
-    request.session[SESSION_KEY] = selection.to_dict()
-    request.session.modified = True
-
-
-class BaseLibraryView(TemplateView):
-    extra_context = {"system_name": "Biblioteca Pública"}
-
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        return ctx
+    get_selection_store(request).save(selection)
 
 
 class GenreListMixin:
@@ -46,23 +58,97 @@ class GenreListMixin:
         qs = super().get_queryset()  # type: ignore
         slug = self.kwargs.get("genre_slug")
         if slug:
-            qs = qs.filter(genre__slug=slug)
+            # Filtrar por genre_id permite usar el índice (genre, title, id);
+            # con un JOIN por slug PostgreSQL recorre todo el catálogo.
+            genre_id = get_genre_id(slug)
+            qs = qs.filter(genre_id=genre_id) if genre_id else qs.none()
         return qs
 
 
-class BookListView(GenreListMixin, ListView):
+class KeysetPaginationMixin:
+    """Reemplaza la paginación por OFFSET de ListView por cursores keyset."""
+    request: Any
+    keyset_ordering: tuple[str, ...] = ("id",)
+    cursor_param = "cursor"
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404("Cursor de paginación inválido")
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class BookListView(KeysetPaginationMixin, GenreListMixin, ListView):
     model = Book
     template_name = "book_list.html"
+    paginate_by = 24
+    keyset_ordering = ("title", "id")
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("genre").defer("search_vector")
     
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return redirect('library:login')
         return super().dispatch(request, *args, **kwargs)
-    
+
+    def get_fragment_key(self):
+        slug = self.kwargs.get("genre_slug")
+        genre_id = get_genre_id(slug) if slug else None
+        scope = genre_scope(genre_id) if genre_id else "catalogue"
+        cursor = self.request.GET.get(self.cursor_param, "")
+        return fragment_key("book_grid", slug or "", cursor, versions=[scope])
+
+    def get_context_data(self, **kwargs):
+        # La cuadrícula es igual para todos: si está en caché no se consulta
+        # la base; lo propio de cada usuario se renderiza en book_list.html.
+        key = self.get_fragment_key()
+        grid = cache.get(key)
+        if grid is None:
+            # Lo que se cachea se lee del primario (ver primary_reads)
+            with primary_reads():
+                context = super().get_context_data(**kwargs)
+                grid = render_to_string("book_grid.html", context)
+            cache.set(key, grid, FRAGMENT_TIMEOUT)
+        else:
+            context = ContextMixin.get_context_data(self, **kwargs)
+        context["book_grid"] = mark_safe(grid)
+        return context
+
+
+class BookSearchView(KeysetPaginationMixin, ListView):
+    template_name = "book_search.html"
+    paginate_by = 24
+    keyset_ordering = ("-rank", "id")
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return redirect('library:login')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_search_terms(self):
+        return self.request.GET.get("q", "").strip()
+
+    def get_queryset(self):
+        terms = self.get_search_terms()
+        if not terms:
+            return Book.objects.annotate(rank=Value(0.0, output_field=FloatField())).none()
+        # El filtro @@ usa el índice GIN; el ranking solo se calcula
+        # sobre las coincidencias. ts_rank devuelve real: se convierte a
+        # double para que el valor del cursor se compare de forma exacta.
+        query = SearchQuery(terms, search_type="websearch", config="spanish")
+        return (
+            Book.objects.filter(search_vector=query)
+            .annotate(rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+            .select_related("genre")
+            .defer("search_vector")
+        )
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
+        ctx["q"] = self.get_search_terms()
         return ctx
 
 
@@ -71,13 +157,22 @@ class BookDetailView(DetailView):
     template_name = "book_detail.html"
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
-    
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx
-
+    queryset = Book.objects.select_related('genre').defer('search_vector')
+
+    def get(self, request, *args, **kwargs):
+        slug = self.kwargs[self.slug_url_kwarg]
+        key = fragment_key('book_detail', slug, versions=[book_scope(slug)])
+        fragment = cache.get(key)
+        self.object = None
+        if fragment is None:
+            with primary_reads():
+                self.object = self.get_object()
+                fragment = render_to_string('book_detail_info.html', {
+                    'object': self.object,
+                    'recommendations': recommendations_for(self.object),
+                })
+            cache.set(key, fragment, FRAGMENT_TIMEOUT)
+        return self.render_to_response(self.get_context_data(book_fragment=mark_safe(fragment)))
 
 
 # SELECCIÓN DE PRÉSTAMO
@@ -86,9 +181,10 @@ class AddToSelectionView(View):
     def post(self, request, book_slug):
         book = get_object_or_404(Book, slug=book_slug)
         
-        # Solo agregar si el libro está disponible
-        if book.available:
-            selection = get_selection(request)
+        selection = get_selection(request)
+        item = selection.items.get(book.id)
+        # Solo agregar si quedan ejemplares libres para una copia más
+        if (item.quantity if item else 0) < book.copies_available:
             selection.add_book(book)
             save_selection(request, selection)
             messages.success(request, f'Libro "{book.title}" agregado a tu selección')
@@ -121,10 +217,319 @@ class SelectionDetailView(TemplateView):
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["selection"] = get_selection(self.request)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx    
+        ctx["selection"] = get_selection(self.request).load_titles()
+        return ctx
+
+
+# VISTAS ASYNC (ASGI)
+#
+# Equivalentes de BookListView, BookDetailView y SelectionDetailView con el
+# ORM y la sesión async. Cargan por adelantado el usuario y el menú para que
+# el renderizado, que ocurre en el event loop, no consulte la base.
+
+async def aprepare_request(request):
+    request.user = await request.auser()
+    return {"genres": await aget_nav_genres()}
+
+
+class AsyncBookListView(View):
+    paginate_by = BookListView.paginate_by
+    keyset_ordering = BookListView.keyset_ordering
+
+    async def get(self, request, genre_slug=None):
+        context = await aprepare_request(request)
+        if not request.user.is_authenticated:
+            return redirect('library:login')
+
+        genre_id = None
+        if genre_slug:
+            genre_id = next((genre.id for genre in context["genres"] if genre.slug == genre_slug), None)
+        cursor = request.GET.get("cursor", "")
+        scope = genre_scope(genre_id) if genre_id else "catalogue"
+        key = await afragment_key("book_grid", genre_slug or "", cursor, versions=[scope])
+        grid = await cache.aget(key)
+        if grid is None:
+            qs = Book.objects.select_related("genre").defer("search_vector")
+            if genre_slug:
+                qs = qs.filter(genre_id=genre_id) if genre_id else qs.none()
+            paginator = KeysetPaginator(qs, self.paginate_by, self.keyset_ordering)
+            try:
+                with primary_reads():
+                    page = await paginator.apage(cursor or None)
+            except InvalidCursor:
+                raise Http404("Cursor de paginación inválido")
+            grid = render_to_string("book_grid.html", {
+                "object_list": page.object_list,
+                "page_obj": page,
+                "is_paginated": page.has_other_pages(),
+            })
+            await cache.aset(key, grid, FRAGMENT_TIMEOUT)
+        context["book_grid"] = mark_safe(grid)
+        return render(request, "book_list.html", context)
+
+
+class AsyncBookDetailView(View):
+    async def get(self, request, slug):
+        context = await aprepare_request(request)
+        key = await afragment_key('book_detail', slug, versions=[book_scope(slug)])
+        fragment = await cache.aget(key)
+        if fragment is None:
+            with primary_reads():
+                book = await Book.objects.select_related('genre').defer('search_vector').filter(slug=slug).afirst()
+                if book is None:
+                    raise Http404("No existe el libro")
+                recommendations = await arecommendations_for(book)
+            fragment = render_to_string('book_detail_info.html', {
+                'object': book,
+                'recommendations': recommendations,
+            })
+            await cache.aset(key, fragment, FRAGMENT_TIMEOUT)
+        context.update(view=self, book_fragment=mark_safe(fragment))
+        return render(request, 'book_detail.html', context)
+
+
+class AsyncSelectionDetailView(View):
+    async def get(self, request):
+        context = await aprepare_request(request)
+        selection = await get_selection_store(request).aload()
+        context["selection"] = await selection.aload_titles()
+        return render(request, "loan_selection_detail.html", context)
+
+
+# API JSON DE SELECCIÓN
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class JsonApiView(View):
+    """Las vistas de la API responden los errores como ``{"error": ...}``."""
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as exc:
+            return JsonResponse({'error': str(exc)}, status=exc.status)
+
+
+class SelectionApiView(JsonApiView):
+    """
+    Base de la API JSON de la selección: cada cambio responde con el estado
+    completo de la selección, sin redirección ni página intermedia.
+    """
+
+    def parse_body(self):
+        try:
+            data = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise ApiError('El cuerpo no es JSON válido')
+        if not isinstance(data, dict):
+            raise ApiError('Se esperaba un objeto JSON')
+        return data
+
+    def parse_item(self, data):
+        try:
+            book_id = int(data['book_id'])
+            quantity = int(data.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ApiError('Cada libro necesita "book_id" y una "quantity" entera')
+        if quantity < 0:
+            raise ApiError('La cantidad no puede ser negativa')
+        return book_id, quantity
+
+    def respond(self, selection, save=True, status=200):
+        if save:
+            save_selection(self.request, selection)
+        return JsonResponse(selection.load_titles().as_json(), status=status)
+
+
+class SelectionStateApiView(SelectionApiView):
+    def get(self, request):
+        return self.respond(get_selection(request), save=False)
+
+
+class SelectionAddApiView(SelectionApiView):
+    """Agrega uno o varios libros: ``{"book_id", "quantity"}`` o ``{"items": [...]}``."""
+
+    def post(self, request):
+        data = self.parse_body()
+        entries = data['items'] if isinstance(data.get('items'), list) else [data]
+        wanted = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise ApiError('Cada libro debe ser un objeto JSON')
+            book_id, quantity = self.parse_item(entry)
+            if quantity < 1:
+                raise ApiError('La cantidad a agregar debe ser al menos 1')
+            wanted[book_id] = wanted.get(book_id, 0) + quantity
+
+        # Ejemplares libres y títulos de todo el lote en una sola consulta
+        books = {
+            book_id: (title, copies_total - copies_on_loan)
+            for book_id, title, copies_total, copies_on_loan in Book.objects.filter(
+                id__in=wanted
+            ).values_list('id', 'title', 'copies_total', 'copies_on_loan')
+        }
+        missing = [book_id for book_id in wanted if book_id not in books]
+        if missing:
+            raise ApiError(f'No existen los libros: {", ".join(map(str, missing))}', status=404)
+
+        selection = get_selection(request)
+        unavailable = [
+            title for book_id, (title, free) in books.items()
+            if wanted[book_id] + (selection.items[book_id].quantity if book_id in selection.items else 0) > free
+        ]
+        if unavailable:
+            raise ApiError(f'No hay ejemplares suficientes: {", ".join(unavailable)}', status=409)
+
+        for book_id, quantity in wanted.items():
+            selection.add_book_id(book_id, quantity, title=books[book_id][0])
+        return self.respond(selection)
+
+
+class SelectionSetQuantityApiView(SelectionApiView):
+    def post(self, request):
+        book_id, quantity = self.parse_item(self.parse_body())
+        selection = get_selection(request)
+        if book_id not in selection.items:
+            raise ApiError('El libro no está en la selección', status=404)
+        if quantity == 0:
+            selection.remove_book(book_id)
+        else:
+            free = Book.objects.filter(id=book_id).values_list(F('copies_total') - F('copies_on_loan'), flat=True).first()
+            if free is None:
+                raise ApiError(f'No existe el libro: {book_id}', status=404)
+            if quantity > free:
+                raise ApiError(f'No hay ejemplares suficientes: quedan {free}', status=409)
+            selection.set_quantity(book_id, quantity)
+        return self.respond(selection)
+
+
+class SelectionRemoveApiView(SelectionApiView):
+    def post(self, request):
+        book_id, _ = self.parse_item(self.parse_body())
+        selection = get_selection(request)
+        selection.remove_book(book_id)
+        return self.respond(selection)
+
+
+class SelectionClearApiView(SelectionApiView):
+    def post(self, request):
+        selection = get_selection(request)
+        selection.clear()
+        return self.respond(selection)
+
+
+# API JSON DEL CATÁLOGO
+
+def catalogue_etag(request, *args, **kwargs):
+    return f'catalogue-{get_version("catalogue")}'
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(get_last_modified('catalogue'), tz=dt_timezone.utc)
+
+
+@method_decorator(condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified), name='get')
+class CatalogueApiView(JsonApiView):
+    """
+    Base de la API de solo lectura del catálogo.
+
+    ETag y Last-Modified salen de la versión ``catalogue`` de la caché, que
+    cambia con cada alta, edición, baja o cambio de disponibilidad de un
+    libro. Un GET condicional vigente se responde con 304 sin consultar la
+    base, y el JSON de cada URL se guarda en caché bajo esa versión.
+    """
+
+    def get(self, request, *args, **kwargs):
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f'library:api:{get_version("catalogue")}:{path}'
+        payload = cache.get(key)
+        if payload is None:
+            with primary_reads():
+                payload = self.get_payload()
+            cache.set(key, payload, API_TIMEOUT)
+        return JsonResponse(payload)
+
+    def get_payload(self):
+        raise NotImplementedError
+
+    def serialize_book(self, book, genre_slugs):
+        return {
+            'id': book.id,
+            'slug': book.slug,
+            'title': book.title,
+            'author': book.author,
+            'genre': genre_slugs.get(book.genre_id),
+            'publication_year': book.publication_year,
+            'available': book.available,
+            'copies_total': book.copies_total,
+            'copies_available': book.copies_available,
+            'url': reverse('library:api_book_detail', args=[book.slug]),
+        }
+
+
+class GenreListApiView(CatalogueApiView):
+    def get_payload(self):
+        return {'results': [
+            {'id': genre.id, 'name': genre.name, 'slug': genre.slug}
+            for genre in get_nav_genres()
+        ]}
+
+
+class BookListApiView(CatalogueApiView):
+    """Libros por título, con ``?genre=<slug>``, ``?available=true|false`` y ``?cursor=``."""
+    paginate_by = 50
+    keyset_ordering = ('title', 'id')
+
+    def get_queryset(self):
+        qs = Book.objects.only(
+            'id', 'slug', 'title', 'author', 'genre_id', 'publication_year',
+            'available', 'copies_total', 'copies_on_loan',
+        )
+        slug = self.request.GET.get('genre')
+        if slug:
+            genre_id = get_genre_id(slug)
+            if genre_id is None:
+                raise ApiError(f'No existe el género "{slug}"', status=404)
+            qs = qs.filter(genre_id=genre_id)
+        available = self.request.GET.get('available')
+        if available is not None:
+            if available not in ('true', 'false'):
+                raise ApiError('"available" debe ser true o false')
+            qs = qs.filter(available=available == 'true')
+        return qs
+
+    def page_url(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params['cursor'] = cursor
+        return f'{self.request.path}?{params.urlencode()}'
+
+    def get_payload(self):
+        paginator = KeysetPaginator(self.get_queryset(), self.paginate_by, self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError('Cursor de paginación inválido')
+        genre_slugs = {genre.id: genre.slug for genre in get_nav_genres()}
+        return {
+            'results': [self.serialize_book(book, genre_slugs) for book in page],
+            'next': self.page_url(page.next_cursor),
+            'previous': self.page_url(page.previous_cursor),
+        }
+
+
+class BookDetailApiView(CatalogueApiView):
+    def get_payload(self):
+        book = Book.objects.defer('search_vector').filter(slug=self.kwargs['slug']).first()
+        if book is None:
+            raise ApiError('No existe el libro', status=404)
+        genre_slugs = {genre.id: genre.slug for genre in get_nav_genres()}
+        return self.serialize_book(book, genre_slugs)
 
 
 # CREAR GÉNEROS Y LIBROS
@@ -142,12 +547,6 @@ class CreateGenreView(LoginRequiredMixin, CreateView):
             return redirect('library:book_list')
         return super().dispatch(request, *args, **kwargs)
     
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx
-    
     def form_valid(self, form):
         messages.success(self.request, f'Género "{form.cleaned_data["name"]}" creado exitosamente!')
         return super().form_valid(form)
@@ -173,12 +572,6 @@ class CreateBookView(LoginRequiredMixin, CreateView):
             return redirect('library:book_list')
         return super().dispatch(request, *args, **kwargs)
     
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx
-    
     def form_valid(self, form):
         messages.success(self.request, f'Libro "{form.cleaned_data["title"]}" agregado al catálogo!')
         return super().form_valid(form)
@@ -200,36 +593,36 @@ class CreateLoanView(CreateView):
     
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["selection"] = get_selection(self.request)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
+        ctx["selection"] = get_selection(self.request).load_titles()
         return ctx
     
     def form_valid(self, form):
-        # Obtener o crear el lector
-        reader, created = Reader.objects.get_or_create(
-            email=form.cleaned_data['email'],
-            defaults={'name': form.cleaned_data['name']}
-        )
-        
-        # Crear el préstamo
-        loan = Loan.objects.create(reader=reader)
-        loan_id = loan.pk  # type: int
-        
-        # Obtener la selección
         selection = get_selection(self.request)
-        
-        # Crear los items del préstamo
-        for book_id, item in selection.items.items():
-            book = Book.objects.get(id=book_id)
-            LoanItem.objects.create(
-                loan=loan,
-                book=book,
-                quantity=item.quantity
-            )
-            # Marcar libro como no disponible
-            book.available = False
-            book.save()
+        if not selection.items:
+            messages.warning(self.request, 'Tu selección está vacía')
+            return redirect('library:selection_detail')
+
+        try:
+            with transaction.atomic():
+                # Obtener o crear el lector
+                reader, created = Reader.objects.get_or_create(
+                    email=form.cleaned_data['email'],
+                    defaults={'name': form.cleaned_data['name']}
+                )
+                # Crear el préstamo y sus ítems, reservando los libros
+                loan = Loan.checkout(reader, selection)
+        except BooksUnavailable as exc:
+            for book_id in [book.id for book in exc.books] + exc.missing_ids:
+                selection.remove_book(book_id)
+            save_selection(self.request, selection)
+            if exc.books:
+                messages.error(self.request, f'Estos libros ya no están disponibles: {exc}')
+            if exc.missing_ids:
+                messages.error(self.request, 'Se quitaron de tu selección libros que ya no están en el catálogo')
+            if not exc.books and not exc.missing_ids:
+                messages.error(self.request, 'Algunos libros de tu selección ya no están disponibles')
+            return redirect('library:selection_detail')
+        loan_id = loan.pk  # type: int
         
         # Limpiar la selección
         selection.clear()
@@ -246,19 +639,18 @@ class LoanSuccessView(DetailView):
     template_name = "loan_success.html"
     pk_url_kwarg = 'loan_id'
     context_object_name = 'loan'
-    
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx
+    queryset = Loan.objects.select_related('reader').prefetch_related(
+        Prefetch('items', queryset=LoanItem.objects.select_related('book'))
+    )
 
 
-class LoanListView(LoginRequiredMixin, ListView):
+class LoanListView(KeysetPaginationMixin, LoginRequiredMixin, ListView):
     model = Loan
     template_name = "loan_list.html"
     context_object_name = "loans"
     login_url = '/login/'
+    paginate_by = 20
+    keyset_ordering = ("-created_at", "-id")
     
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_superuser:
@@ -266,13 +658,33 @@ class LoanListView(LoginRequiredMixin, ListView):
             return redirect('library:book_list')
         return super().dispatch(request, *args, **kwargs)
     
+    def get_filter_form(self):
+        if not hasattr(self, "_filter_form"):
+            self._filter_form = LoanFilterForm(self.request.GET or None)
+        return self._filter_form
+
     def get_queryset(self):
-        return Loan.objects.all().order_by('-created_at')
+        # Lector, ítems y libros se cargan en un número fijo de consultas;
+        # el total de libros se calcula en la base de datos.
+        items = LoanItem.objects.select_related('book').only(
+            'loan', 'quantity', 'book__title', 'book__author'
+        )
+        totals = (
+            LoanItem.objects.filter(loan=OuterRef('pk'))
+            .values('loan')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        )
+        qs = (
+            Loan.objects.select_related('reader')
+            .annotate(books_total=Coalesce(Subquery(totals), 0))
+            .prefetch_related(Prefetch('items', queryset=items))
+        )
+        return self.get_filter_form().filter(qs)
     
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
+        ctx["filter_form"] = self.get_filter_form()
         return ctx
 
 
@@ -284,20 +696,13 @@ class ReturnLoanView(LoginRequiredMixin, View):
             messages.error(request, 'No tienes permisos para marcar devoluciones')
             return redirect('library:book_list')
         
-        loan = get_object_or_404(Loan, id=loan_id)
+        loan = get_object_or_404(Loan.objects.only('id', 'reader'), id=loan_id)
         
-        if loan.status == 'returned':
-            messages.warning(request, 'Este préstamo ya fue marcado como devuelto')
-        else:
-            # Marcar préstamo como devuelto
-            loan.mark_returned()
-            
-            # Marcar todos los libros como disponibles nuevamente
-            for item in loan.items.all():
-                item.book.available = True
-                item.book.save()
-            
+        # Marca el préstamo como devuelto y libera sus libros
+        if loan.mark_returned():
             messages.success(request, f'Préstamo devuelto exitosamente. Los libros están disponibles nuevamente.')
+        else:
+            messages.warning(request, 'Este préstamo ya fue marcado como devuelto')
         
         return redirect('library:loan_list')
 
@@ -314,20 +719,133 @@ class DeleteBookView(LoginRequiredMixin, View):
         
         book = get_object_or_404(Book, slug=slug)
         
-        active_loans = LoanItem.objects.filter(book=book, loan__status='active')
-        if active_loans.exists():
+        # El historial no se borra: pasa al archivo, que guarda el título. Los
+        # préstamos sin devolver o devueltos hace menos de
+        # LIBRARY_ARCHIVE_AFTER_DAYS siguen en las tablas activas hasta que
+        # archive_loans los mueva, y mientras tanto el libro no se elimina.
+        cutoff = timezone.localdate() - timedelta(days=settings.LIBRARY_ARCHIVE_AFTER_DAYS)
+        loans = Loan.objects.filter(id__in=LoanItem.objects.filter(book=book).values('loan_id'))
+        if loans.exclude(status='returned', created_at__lt=cutoff).exists():
+            messages.error(request, f'No se puede eliminar "{book.title}" porque tiene préstamos sin devolver o devueltos hace menos de {settings.LIBRARY_ARCHIVE_AFTER_DAYS} días.')
+            return redirect('library:book_list')
+
+        # Los antiguos que archive_loans aún no trasladó se archivan aquí, a
+        # lo sumo un lote por petición
+        limit = settings.LIBRARY_DELETE_BOOK_ARCHIVE_BATCH
+        try:
+            with transaction.atomic():
+                if Loan.archive(loans, limit=limit, skip_locked=False) == limit:
+                    messages.warning(request, f'Se archivaron {limit} préstamos antiguos de "{book.title}". Vuelve a intentarlo para continuar.')
+                    return redirect('library:book_list')
+                book.delete()
+        except ProtectedError:
+            # Un préstamo nuevo entre la comprobación y el borrado
             messages.error(request, f'No se puede eliminar "{book.title}" porque está en préstamos activos. Marca los préstamos como devueltos primero.')
             return redirect('library:book_list')
         
-        returned_loan_items = LoanItem.objects.filter(book=book, loan__status='returned')
-        returned_loan_items.delete()
-        
         book_title = book.title
-        book.delete()
         messages.success(request, f'Libro "{book_title}" eliminado exitosamente')
         return redirect('library:book_list')
 
 
+# EXPORTACIONES CSV
+
+class ExportCsvView(LoginRequiredMixin, View):
+    """Descarga en streaming de préstamos, lectores o libros para auditorías."""
+    login_url = '/login/'
+
+    def get(self, request, dataset):
+        if not request.user.is_superuser:
+            messages.error(request, 'No tienes permisos para exportar datos')
+            return redirect('library:book_list')
+        if dataset not in EXPORTS:
+            raise Http404("Exportación desconocida")
+        # Bajo ASGI el contenido tiene que ser asíncrono para salir por bloques
+        content = astream_csv(dataset) if isinstance(request, ASGIRequest) else stream_csv(dataset)
+        response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+        filename = f'{dataset}-{timezone.localdate().isoformat()}.csv'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+# ESTADÍSTICAS DE CIRCULACIÓN
+
+class StatsView(LoginRequiredMixin, TemplateView):
+    """
+    Panel de circulación. Cada bloque sale de una consulta sobre los
+    resúmenes de library/stats.py, nunca de recorrer los préstamos.
+    """
+    template_name = "stats.html"
+    login_url = '/login/'
+    # Más de 90 días ya no es «reciente»: el panel por mes cubre el año
+    periods = (7, 30, 90)
+    top_books = 10
+    months = 12
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated and not request.user.is_superuser:
+            messages.error(request, 'No tienes permisos para ver las estadísticas')
+            return redirect('library:book_list')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        return days if days in self.periods else 30
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        today = timezone.localdate()
+        days = self.get_days()
+        since = today - timedelta(days=days - 1)
+
+        statuses = dict(LoanStatusCount.objects.values_list('status', 'count'))
+        # Se agrega sin unir los libros y solo se buscan los títulos del top
+        top_books = list(
+            DailyBookCirculation.objects.filter(day__gte=since)
+            .values('book_id')
+            .annotate(loans=Sum('loans'), copies=Sum('copies'))
+            .order_by('-loans', 'book_id')[:self.top_books]
+        )
+        books = Book.objects.only('title', 'slug').in_bulk([row['book_id'] for row in top_books])
+        for row in top_books:
+            row['book'] = books.get(row['book_id'])
+        daily = DailyCirculation.objects.filter(day__gte=since).order_by('day').values('day', 'loans', 'copies')
+
+        # Préstamos por género y mes: filas por género, columnas por mes
+        year, month = divmod(today.year * 12 + today.month - 1 - (self.months - 1), 12)
+        first_month = today.replace(year=year, month=month + 1, day=1)
+        by_genre = defaultdict(dict)
+        months = set()
+        for row in (
+            DailyGenreCirculation.objects.filter(day__gte=first_month)
+            .annotate(month=TruncMonth('day'))
+            .values('month', 'genre__name')
+            .annotate(loans=Sum('loans'))
+            .order_by()
+        ):
+            by_genre[row['genre__name']][row['month']] = row['loans']
+            months.add(row['month'])
+        months = sorted(months)
+
+        ctx.update({
+            'days': days,
+            'periods': self.periods,
+            'active_count': statuses.get('active', 0),
+            'late_count': statuses.get('late', 0),
+            'top_books': top_books,
+            'daily': daily,
+            'months': months,
+            'genre_rows': [
+                (name, [per_month.get(month, 0) for month in months])
+                for name, per_month in sorted(by_genre.items())
+            ],
+        })
+        return ctx
+
+
 # AUTENTICACIÓN
 
 class CustomLoginView(LoginView):
@@ -361,10 +879,4 @@ class RegisterView(CreateView):
         for field, errors in form.errors.items():
             for error in errors:
                 messages.error(self.request, str(error))
-        return super().form_invalid(form)
-    
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["genres"] = Genre.objects.all()
-        ctx["system_name"] = "Biblioteca Pública"
-        return ctx
\ No newline at end of file
+        return super().form_invalid(form)
\ No newline at end of file